@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 from datetime import timedelta
+from celery.schedules import crontab
 import os
 from pathlib import Path
 
@@ -101,6 +102,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+
+# O cache de respostas do catálogo depende da versão incrementada pelo Celery; sem um cache compartilhado (LocMem,
+# por processo) a invalidação não chega aos workers do gunicorn, então ele fica desligado.
+CACHE_CATALOGO = bool(os.getenv('CACHE_URL'))
+
+# Bilhetes
+
+# A compra em lote grava todos os bilhetes e palpites em uma transação com a carteira travada.
+MAX_BILHETES_LOTE = int(os.getenv('MAX_BILHETES_LOTE', 50))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -208,3 +230,21 @@ EMAIL_HOST_PASSWORD = os.getenv('SENHA_EMAIL')
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_BROKER")
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'iniciar-boloes': {
+        'task': 'bolao.tasks.iniciar_boloes',
+        'schedule': timedelta(minutes=1),
+    },
+    'finalizar-boloes': {
+        'task': 'bolao.tasks.finalizar_boloes',
+        'schedule': timedelta(minutes=10),
+    },
+    'consolidar-carteira-banca': {
+        'task': 'usuario.tasks.consolidar_carteira_banca',
+        'schedule': timedelta(minutes=5),
+    },
+    'registrar-saldos-diarios': {
+        'task': 'usuario.tasks.registrar_saldos_diarios',
+        'schedule': crontab(hour=0, minute=5),
+    },
+}
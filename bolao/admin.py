@@ -1,55 +1,97 @@
-from celery import current_app
 from django.contrib import admin, messages
+from django.db import transaction
 
 from . import STATUS_JOGO_FINALIZADO_API, STATUS_BOLAO
 
 from .models import Campeonato, Time, Jogo, Bolao, Bilhete, Palpite
 from .forms import PalpitePlacarForm
+from core.cache import invalidar_catalogo
+from core.custom_exception import CotaInsuficiente, LimiteProvedorExcedido
 from core.network.football import API
 
 
+class InvalidarCatalogoMixin:
+    """Edições do catálogo pelo admin incrementam a versão do cache das listagens."""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(invalidar_catalogo)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(invalidar_catalogo)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(invalidar_catalogo)
+
+
 @admin.register(Campeonato)
-class CampeonatoAdmin(admin.ModelAdmin):
+class CampeonatoAdmin(InvalidarCatalogoMixin, admin.ModelAdmin):
     list_display = ('nome', 'pais', 'tipo', 'ativo', 'temporada_atual')
     search_fields = ('nome', 'pais', 'tipo')
     actions = ['buscar_campeonatos', 'desativar_campeonatos', 'ativar_campeonatos']
 
-    def buscar_campeonatos(self, _, queryset):
-        if API.buscar_e_salvar_competicoes():
-            queryset = Campeonato.objects.all()
+    def buscar_campeonatos(self, request, queryset):
+        try:
+            if API.buscar_e_salvar_competicoes():
+                queryset = Campeonato.objects.all()
+        except (CotaInsuficiente, LimiteProvedorExcedido) as e:
+            messages.error(request, e.message)
         return queryset
 
     def desativar_campeonatos(self, _, queryset):
         queryset.update(ativo=False)
+        invalidar_catalogo()
 
     def ativar_campeonatos(self, _, queryset):
         queryset.update(ativo=True)
+        invalidar_catalogo()
 
 
 @admin.register(Time)
-class TimeAdmin(admin.ModelAdmin):
+class TimeAdmin(InvalidarCatalogoMixin, admin.ModelAdmin):
     list_display = ('nome', 'id_externo', 'logo')
     search_fields = ('nome', )
 
 
 @admin.register(Jogo)
-class JogoAdmin(admin.ModelAdmin):
+class JogoAdmin(InvalidarCatalogoMixin, admin.ModelAdmin):
     list_display = ['time_casa', 'time_fora', 'status', 'data', 'placar_casa',
                     'placar_fora', 'vencedor', 'campeonato']
     list_filter = ['status', 'data']
     actions = ['atualizar_resultados', 'buscar_e_salvar_jogos']
 
-    def buscar_e_salvar_jogos(self, _, queryset):
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # Resultado digitado no admin segue o mesmo caminho de API.salvar_resultdo, a partir da linha travada.
+        antigo = Jogo.objects.select_for_update().get(pk=obj.pk)
+        super().save_model(request, obj, form, change)
+        API.processar_resultado(obj, antigo.placar_contabilizado(), antigo.finalizado)
+        if antigo.finalizado and not obj.finalizado:
+            for bolao in Bolao.objects.filter(jogos=obj):
+                bolao.atualizar_dados_jogos()
+        elif antigo.data != obj.data:
+            Bolao.atualizar_primeiro_jogo(Bolao.objects.filter(jogos=obj))
+
+    def buscar_e_salvar_jogos(self, request, queryset):
         campeonatos = Campeonato.objects.filter(ativo=True)
-        if API.buscar_e_salvar_jogos(campeonatos):
-            queryset = Jogo.objects.all()
+        try:
+            if API.buscar_e_salvar_jogos(campeonatos):
+                queryset = Jogo.objects.all()
+        except (CotaInsuficiente, LimiteProvedorExcedido) as e:
+            messages.error(request, e.message)
         return queryset
 
-    def atualizar_resultados(self, _, queryset):
-        if API.atualizar_resultados(queryset):
-            for jogo in queryset:
-                current_app.send_task('bolao.tasks.finalizar_boloes', args=(jogo.id_externo, ))
-            queryset = Jogo.objects.all()
+    def atualizar_resultados(self, request, queryset):
+        # A finalização dos bolões que zeraram os jogos pendentes é enfileirada por API.salvar_resultdo.
+        try:
+            if API.atualizar_resultados(queryset):
+                queryset = Jogo.objects.all()
+        except (CotaInsuficiente, LimiteProvedorExcedido) as e:
+            messages.error(request, e.message)
         return queryset
 
 
@@ -59,19 +101,24 @@ class BolaoAdmin(admin.ModelAdmin):
                     'bilhetes_minimos', 'taxa_banca', 'status']
     list_filter = ['criador', 'estorno']
     search_fields = ['codigo', 'criador', 'valor_palpite']
+    # Mantidos por UPDATEs próprios; Bolao.save não grava esses campos.
+    readonly_fields = Bolao.CAMPOS_DENORMALIZADOS
     actions = ['cancelar_bolao', 'finalizar_bolao']
 
     def get_jogos(self, obj):
         return ''.join((str(j) for j in obj.jogos.all()))
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.atualizar_dados_jogos()
+
     def cancelar_bolao(self, request, queryset):
         for bolao in queryset:
             if getattr(request.user, 'is_superuser', False) or bolao.criador.id == request.user.id:
-                if bolao.status == STATUS_BOLAO['FINALIZADO'] or bolao.status == STATUS_BOLAO['CANCELADO']:
+                if not bolao.cancelar_bolao():
                     messages.error(request, f"Erro ao cancelar o bolão {bolao.codigo}. \
                                    O bolão já está {bolao.status.lower()}!")
                 else:
-                    bolao.cancelar_bolao()
                     messages.success(request, f"Sucesso ao cancelar o bolão {bolao.codigo}.")
             else:
                 messages.error(request, f"Erro ao cancelar o bolão {bolao.codigo}. Você não tem permissão!")
@@ -80,7 +127,7 @@ class BolaoAdmin(admin.ModelAdmin):
         if getattr(request.user, 'is_superuser', False):
             status = tuple(STATUS_JOGO_FINALIZADO_API.split('-'))
             for bolao in queryset:
-                if all([jogo.status in status for jogo in bolao.jogos.all()]):
+                if not bolao.jogos.exclude(status__in=status).exists():
                     if bolao.status == STATUS_BOLAO['FINALIZADO'] or bolao.status == STATUS_BOLAO['CANCELADO']:
                         messages.error(request, f"Erro ao finalizar o bolão {bolao.codigo}. \
                                        O bolão já está {bolao.status.lower()}!")
@@ -101,3 +148,9 @@ class PalpitePlacarInline(admin.TabularInline):
 class PalpiteAdmin(admin.ModelAdmin):
     inlines = (PalpitePlacarInline, )
     list_display = ['bolao', 'usuario']
+    # Mantidos por UPDATEs próprios; Bilhete.save não grava esses campos.
+    readonly_fields = Bilhete.CAMPOS_DENORMALIZADOS
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.atualizar_assinatura()
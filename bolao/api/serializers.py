@@ -1,7 +1,9 @@
 from datetime import timedelta
 import os
+from typing import List
 from decimal import Decimal
 from rest_framework import serializers
+from django.conf import settings
 from django.utils import timezone
 
 from bolao import STATUS_BOLAO
@@ -48,14 +50,18 @@ class BolaoSerializer(serializers.ModelSerializer):
         extra_kwargs = {'criador': {'write_only': True}}
 
     def get_qtd_palpites(self, obj):
-        return obj.bilhetes.count()
+        return obj.qtd_bilhetes
 
     def get_posivel_retorno(self, obj):
-        total = obj.bilhetes.count() * obj.valor_palpite
+        total = obj.total_arrecadado
         taxa = Decimal(round((100 - (obj.taxa_banca + obj.taxa_criador)) / 100, 2))
         return total * taxa
 
     def get_vencedores(self, obj):
+        if hasattr(obj, 'vencedores_prefetch'):
+            return [bilhete.usuario.nome_formatado for bilhete in obj.vencedores_prefetch]
+        if obj.status != STATUS_BOLAO['FINALIZADO']:
+            return []
         return [usuario.nome_formatado for usuario in obj.buscar_vencedores()]
 
 
@@ -65,6 +71,11 @@ class CriarBolaoSerializer(serializers.ModelSerializer):
         model = Bolao
         fields = ['criador', 'valor_palpite', 'codigo', 'jogos', 'estorno', 'taxa_criador']
 
+    def create(self, validated_data):
+        bolao = super().create(validated_data)
+        bolao.atualizar_dados_jogos()
+        return bolao
+
     def validate_jogos(self, value):
         now = timezone.now() - timedelta(minutes=5)
         for jogo in value:
@@ -154,3 +165,79 @@ class BilheteCriarSerializer(serializers.ModelSerializer):
         if attrs['usuario'].carteira.saque_valido(attrs['bolao'].valor_palpite):
             return super().validate(attrs)
         raise serializers.ValidationError("Saldo insuficiente.")
+
+
+class PalpiteCompraSerializer(serializers.Serializer):
+
+    jogo = serializers.UUIDField()
+    placar_casa = serializers.IntegerField(
+        min_value=0, error_messages={'min_value': 'O placar do time casa deve ser maior ou igual a 0.'})
+    placar_fora = serializers.IntegerField(
+        min_value=0, error_messages={'min_value': 'O placar do time fora deve ser maior ou igual a 0.'})
+
+
+class BilheteCompraSerializer(serializers.Serializer):
+    """
+    Compra de um bilhete com todos os seus palpites.
+
+    Os jogos do bolão são lidos uma única vez e o pertencimento, a cobertura e o horário de início são validados com
+    operações de conjunto. A gravação fica em Bilhete.comprar_em_lote (bulk_create e um único débito).
+    """
+
+    bolao = serializers.PrimaryKeyRelatedField(queryset=Bolao.objects.all())
+    palpites = PalpiteCompraSerializer(many=True, allow_empty=False)
+
+    def palpites_por_bilhete(self, attrs) -> List[List]:
+        return [attrs['palpites']]
+
+    def validate(self, attrs):
+        bolao = attrs['bolao']
+        if bolao.status_atualizado != STATUS_BOLAO['ATIVO']:
+            raise serializers.ValidationError('Este bolão não está mais aceitando palpites.')
+        jogos = dict(bolao.jogos.values_list('id', 'data'))
+        agora = timezone.now()
+        if any(data <= agora for data in jogos.values()):
+            raise serializers.ValidationError('Este bolão não está mais aceitando palpites.')
+        bilhetes = self.palpites_por_bilhete(attrs)
+        for palpites in bilhetes:
+            self.validar_palpites(jogos.keys(), palpites)
+        if not self.context['request'].user.carteira.saque_valido(bolao.valor_palpite * len(bilhetes)):
+            raise serializers.ValidationError("Saldo insuficiente.")
+        return attrs
+
+    @staticmethod
+    def validar_palpites(jogos, palpites):
+        enviados = [palpite['jogo'] for palpite in palpites]
+        if len(set(enviados)) != len(enviados):
+            raise serializers.ValidationError('Cada jogo deve ter apenas um palpite.')
+        if set(enviados) - jogos:
+            raise serializers.ValidationError('Há palpites para jogos que não fazem parte do bolão.')
+        if jogos - set(enviados):
+            raise serializers.ValidationError('O bilhete deve ter um palpite para cada jogo do bolão.')
+
+    def comprar(self, validated_data) -> List[Bilhete]:
+        palpites_por_bilhete = [[(palpite['jogo'], palpite['placar_casa'], palpite['placar_fora'])
+                                 for palpite in palpites]
+                                for palpites in self.palpites_por_bilhete(validated_data)]
+        return Bilhete.comprar_em_lote(self.context['request'].user, validated_data['bolao'], palpites_por_bilhete)
+
+    def create(self, validated_data):
+        return self.comprar(validated_data)[0]
+
+
+class PalpitesBilheteSerializer(serializers.Serializer):
+
+    palpites = PalpiteCompraSerializer(many=True, allow_empty=False)
+
+
+class BilheteLoteCompraSerializer(BilheteCompraSerializer):
+    """Vários bilhetes do mesmo bolão validados juntos e pagos com um único débito."""
+
+    palpites = None
+    bilhetes = PalpitesBilheteSerializer(many=True, allow_empty=False, max_length=settings.MAX_BILHETES_LOTE)
+
+    def palpites_por_bilhete(self, attrs) -> List[List]:
+        return [bilhete['palpites'] for bilhete in attrs['bilhetes']]
+
+    def create(self, validated_data):
+        return self.comprar(validated_data)
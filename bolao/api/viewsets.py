@@ -1,21 +1,27 @@
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.db.models import Count, Max
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
 
-from bolao.api.serializers import (PalpiteCriarSerializer, BilheteCriarSerializer, BilheteSerializer, BolaoSerializer,
-                                   CampeonatoSerializer, JogoSerializer, TimeSerializer, CriarBolaoSerializer)
+from bolao.api.serializers import (BilheteCompraSerializer, BilheteCriarSerializer, BilheteLoteCompraSerializer,
+                                   BilheteSerializer, BolaoSerializer, CampeonatoSerializer, JogoSerializer,
+                                   TimeSerializer, CriarBolaoSerializer)
 from bolao.filters import BolaoFilter
 from bolao.mixins import ListCreateDetailOnlyMixin
 from bolao.models import Bilhete, Campeonato, Jogo, Time, Bolao
 from core.custom_exception import SaldoInvalidoException
+from core.cache import versao_catalogo
+from core.mixins import CacheCatalogoMixin, ETagMixin
+from core.pagination import CursorPaginacao
 from core.permissions import LEITURA_OU_AUTENTICACAO_COMPLETA
 from bolao import STATUS_BOLAO
 
 
-class CampeonatoViewSet(ReadOnlyModelViewSet):
+class CampeonatoViewSet(CacheCatalogoMixin, ReadOnlyModelViewSet):
     queryset = Campeonato.objects.filter(ativo=True)
     serializer_class = CampeonatoSerializer
     permission_classes = LEITURA_OU_AUTENTICACAO_COMPLETA
@@ -23,7 +29,7 @@ class CampeonatoViewSet(ReadOnlyModelViewSet):
     ordering_fields = ['nome']
 
 
-class TimeViewSet(ReadOnlyModelViewSet):
+class TimeViewSet(CacheCatalogoMixin, ReadOnlyModelViewSet):
     queryset = Time.objects.all()
     serializer_class = TimeSerializer
     permission_classes = LEITURA_OU_AUTENTICACAO_COMPLETA
@@ -31,29 +37,44 @@ class TimeViewSet(ReadOnlyModelViewSet):
     ordering_fields = ['nome']
 
 
-class JogoViewSet(ReadOnlyModelViewSet):
+class JogoViewSet(ETagMixin, CacheCatalogoMixin, ReadOnlyModelViewSet):
     queryset = Jogo.objects.all()
     serializer_class = JogoSerializer
     permission_classes = LEITURA_OU_AUTENTICACAO_COMPLETA
+    pagination_class = CursorPaginacao
+    ordering = ('-data', '-id')
     filterset_fields = ['data', 'status']
     search_fields = ['campeonato__nome', 'time_casa__nome', 'time_fora__nome']
     ordering_fields = ['data', 'status']
 
+    def versao_etag(self):
+        if self.action != 'list':
+            return None
+        if settings.CACHE_CATALOGO:
+            # Toda escrita em jogos (sincronização, resultados e admin) incrementa a versão do catálogo, e os filtros
+            # e o cursor já estão no caminho que entra no ETag: o 304 sai sem nenhuma consulta.
+            return str(versao_catalogo())
+        dados = self.filter_queryset(self.get_queryset()).aggregate(atualizado=Max('updated_at'), total=Count('id'))
+        return f"{versao_catalogo()}:{dados['atualizado']}:{dados['total']}"
 
-class BolaoViewSet(ModelViewSet):
+
+class BolaoViewSet(ETagMixin, ModelViewSet):
 
     queryset = Bolao.objects.all()
     serializer_class = BolaoSerializer
     filterset_class = BolaoFilter
+    pagination_class = CursorPaginacao
+    ordering = ('-created_at', '-id')
     search_fields = ['codigo', 'jogos__time_casa__nome', 'jogos__time_fora__nome']
-    ordering_fields = ['estorno', 'taxa_banca', 'taxa_criador', 'taxa_criador', 'status', 'bilhetes_minimos']
+    ordering_fields = ['estorno', 'taxa_banca', 'taxa_criador', 'status', 'bilhetes_minimos']
 
     def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve', 'meus_boloes'):
+            queryset = queryset.para_leitura()
         if self.action == 'list':
-            if status := self.request.GET.get('status'):
-                return self.queryset.filter(status=status)
-            return self.queryset.filter(status=STATUS_BOLAO['ATIVO'])
-        return super().get_queryset()
+            return queryset.por_status(self.request.GET.get('status') or STATUS_BOLAO['ATIVO'])
+        return queryset
 
     def create(self, request):
         serializer = CriarBolaoSerializer(data={**request.data, 'criador': request.user.id})
@@ -61,23 +82,36 @@ class BolaoViewSet(ModelViewSet):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def versao_etag(self):
+        if self.action != 'retrieve':
+            return None
+        dados = Bolao.objects.filter(pk=self.kwargs['pk']).values(
+            'updated_at', 'status', 'qtd_bilhetes', 'total_arrecadado').annotate(
+            jogos_atualizados=Max('jogos__updated_at'), qtd_jogos=Count('jogos')).first()
+        if dados is None:
+            return None
+        return ':'.join(str(valor) for valor in dados.values())
+
     def retrieve(self, request, pk=None):
-        bolao = get_object_or_404(self.queryset, pk=pk)
+        return self.resposta_condicional(request, self.detalhar, pk=pk)
+
+    def detalhar(self, request, pk=None):
+        bolao = get_object_or_404(self.get_queryset(), pk=pk)
         serializer = BolaoSerializer(bolao)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def destroy(self, request, pk=None):
         bolao = get_object_or_404(self.queryset, pk=pk)
         if request.user == bolao.criador:
-            if bolao.status_atualizado in (STATUS_BOLAO['ATIVO'], STATUS_BOLAO['PALPITES PAUSADOS']):
-                bolao.cancelar_bolao()
+            if bolao.status_atualizado in (STATUS_BOLAO['ATIVO'], STATUS_BOLAO['PALPITES PAUSADOS']) and \
+               bolao.cancelar_bolao():
                 return Response({'message': 'Sucesso!'}, status=status.HTTP_200_OK)
             return Response({'message': 'O bolão não pode mais ser cancelado.'}, status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_401_UNAUTHORIZED)
 
     @action(detail=False, methods=['GET'], url_path='meus-boloes')
     def meus_boloes(self, request):
-        queryset = self.queryset.filter(criador=request.user)
+        queryset = self.get_queryset().filter(criador=request.user)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -105,16 +139,21 @@ class BilheteViewSet(ListCreateDetailOnlyMixin, ModelViewSet):
 
     @transaction.atomic
     def create(self, request):
+        serializer = BilheteCompraSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        try:
+            bilhete = serializer.save()
+        except SaldoInvalidoException as e:
+            return Response(e.serializer, status=status.HTTP_402_PAYMENT_REQUIRED)
+        return Response(BilheteCriarSerializer(bilhete).data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['POST'], url_path='comprar-lote')
+    @transaction.atomic
+    def comprar_lote(self, request):
+        serializer = BilheteLoteCompraSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
         try:
-            bilhete_serializer = BilheteCriarSerializer(data={'bolao': request.data['bolao'],
-                                                              'usuario': request.user.id})
-            bilhete_serializer.is_valid(raise_exception=True)
-            bilhete = bilhete_serializer.save()
-            for palpite in request.data['palpites']:
-                palpite['bilhete'] = bilhete.id
-                palpite_seriaizer = PalpiteCriarSerializer(data=palpite)
-                palpite_seriaizer.is_valid(raise_exception=True)
-                palpite_seriaizer.save()
-            return Response(bilhete_serializer.data, status=status.HTTP_200_OK)
+            bilhetes = serializer.save()
         except SaldoInvalidoException as e:
-            return Response(e.serialize, status=status.HTTP_402_PAYMENT_REQUIRED)
+            return Response(e.serializer, status=status.HTTP_402_PAYMENT_REQUIRED)
+        return Response(BilheteCriarSerializer(bilhetes, many=True).data, status=status.HTTP_200_OK)
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bolao.models import Bolao
+from bolao.pontuacao import PontuacaoVetorizada
+
+
+class Command(BaseCommand):
+    help = 'Compara o tempo de apuração dos vencedores de um bolão entre Bilhete.acertou, a consulta agregada ' \
+           'e o motor vetorizado.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bolao', help='ID do bolão.')
+        parser.add_argument('--processos', type=int, default=1, help='Processos do motor vetorizado.')
+        parser.add_argument('--sem-objetos', action='store_true',
+                            help='Não executa o caminho por objeto (Bilhete.acertou), lento em bolões grandes.')
+
+    def medir(self, nome, funcao):
+        inicio = time.perf_counter()
+        vencedores = set(funcao())
+        self.stdout.write(f'{nome:<12} {time.perf_counter() - inicio:>10.3f}s  {len(vencedores)} vencedores')
+        return vencedores
+
+    def handle(self, *args, **options):
+        bolao = Bolao.objects.get(id=options['bolao'])
+        self.stdout.write(f'Bolão {bolao.codigo}: {bolao.bilhetes.count()} bilhetes, {bolao.jogos.count()} jogos')
+
+        resultados = []
+        if not options['sem_objetos']:
+            resultados.append(self.medir('objetos', lambda: [bilhete.id for bilhete in bolao.bilhetes.all()
+                                                             if bilhete.acertou]))
+        resultados.append(self.medir('agregado', lambda: bolao.vencedores_por_acertos().values_list('id', flat=True)))
+        resultados.append(self.medir('vetorizado', lambda: PontuacaoVetorizada(bolao).vencedores(
+            options['processos'])))
+
+        if any(resultado != resultados[-1] for resultado in resultados):
+            self.stdout.write(self.style.WARNING('Os caminhos divergiram no conjunto de vencedores.'))
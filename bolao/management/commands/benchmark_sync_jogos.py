@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bolao.models import Campeonato, Jogo, Time
+from core.network.football import API
+
+
+class Command(BaseCommand):
+    help = 'Compara a gravação de fixtures sintéticas uma a uma e em lote (upsert). Nada é persistido.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', type=int, default=2000)
+        parser.add_argument('--times', type=int, default=200, help='Quantidade de times distintos.')
+
+    def fixtures(self, campeonato, quantidade, times, deslocamento):
+        return [({
+            'fixture': {'id': f'bench-{deslocamento + i}', 'status': {'short': 'NS'},
+                        'date': '2030-01-01T16:00:00-03:00'},
+            'teams': {'home': {'id': f'bench-{i % times}', 'name': f'Time {i % times}', 'logo': ''},
+                      'away': {'id': f'bench-{(i + 1) % times}', 'name': f'Time {(i + 1) % times}', 'logo': ''}},
+            'goals': {'home': None, 'away': None},
+        }, campeonato) for i in range(quantidade)]
+
+    @staticmethod
+    def salvar_um_a_um(jogo, campeonato):
+        """Gravação anterior ao upsert em lote: get_or_create por time e update_or_create por jogo."""
+        times = [Time.objects.get_or_create(id_externo=str(time['id']),
+                                            defaults={'nome': time['name'], 'logo': time['logo']})[0]
+                 for time in (jogo['teams']['home'], jogo['teams']['away'])]
+        placar_casa, placar_fora = jogo['goals']['home'], jogo['goals']['away']
+        return Jogo.objects.update_or_create(id_externo=jogo['fixture']['id'], defaults={
+            'time_casa': times[0],
+            'time_fora': times[1],
+            'status': jogo['fixture']['status']['short'],
+            'data': timezone.datetime.strptime(jogo['fixture']['date'], '%Y-%m-%dT%H:%M:%S-03:00'),
+            'placar_casa': placar_casa,
+            'placar_fora': placar_fora,
+            'vencedor': API.obter_vencedor(placar_casa, placar_fora),
+            'campeonato': campeonato,
+        })[0]
+
+    def medir(self, nome, funcao):
+        consultas = []
+
+        def contar(execute, sql, params, many, context):
+            consultas.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            funcao()
+            duracao = time.perf_counter() - inicio
+        self.stdout.write(f'{nome:<10} {duracao:>8.2f}s  {len(consultas):>6} consultas')
+
+    def handle(self, *args, **options):
+        quantidade, times = options['fixtures'], options['times']
+        with transaction.atomic():
+            campeonato = Campeonato.objects.create(nome='Benchmark', pais='Brasil', temporada_atual='2030')
+            um_a_um = self.fixtures(campeonato, quantidade, times, 0)
+            em_lote = self.fixtures(campeonato, quantidade, times, quantidade)
+            self.medir('um a um', lambda: [self.salvar_um_a_um(jogo, campeonato) for jogo, _ in um_a_um])
+            self.medir('em lote', lambda: API.salvar_jogos(em_lote))
+            transaction.set_rollback(True)
@@ -0,0 +1,35 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+
+from bolao.models import Bilhete, Palpite
+
+
+class Command(BaseCommand):
+    help = 'Preenche a assinatura dos bilhetes a partir dos palpites salvos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true', help='Recalcula também os bilhetes que já têm assinatura.')
+        parser.add_argument('--lote', type=int, default=2000, help='Quantidade de bilhetes por UPDATE.')
+
+    def handle(self, *args, **options):
+        palpites = Palpite.objects.order_by('bilhete_id')
+        if not options['todos']:
+            palpites = palpites.filter(bilhete__assinatura__isnull=True)
+        linhas = palpites.values_list('bilhete_id', 'jogo_id', 'placar_casa', 'placar_fora').iterator(
+            chunk_size=options['lote'])
+
+        total, lote = 0, []
+        for bilhete_id, grupo in groupby(linhas, key=lambda linha: linha[0]):
+            assinatura = Bilhete.calcular_assinatura(linha[1:] for linha in grupo)
+            lote.append(Bilhete(id=bilhete_id, assinatura=assinatura))
+            if len(lote) >= options['lote']:
+                total += self.salvar(lote)
+                lote = []
+        total += self.salvar(lote)
+        self.stdout.write(self.style.SUCCESS(f'{total} bilhetes atualizados.'))
+
+    @staticmethod
+    def salvar(bilhetes):
+        Bilhete.objects.bulk_update(bilhetes, ['assinatura'])
+        return len(bilhetes)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from bolao import STATUS_JOGO_FINALIZADO_API
+from bolao.models import Bilhete, Palpite
+
+
+class Command(BaseCommand):
+    help = 'Recalcula do zero o contador de acertos dos bilhetes a partir dos jogos finalizados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bolao', help='Recalcula apenas os bilhetes deste bolão.')
+
+    def handle(self, *args, **options):
+        acertos = Palpite.objects.filter(
+            bilhete=OuterRef('pk'),
+            jogo__status__in=STATUS_JOGO_FINALIZADO_API.split('-'),
+            placar_casa=F('jogo__placar_casa'),
+            placar_fora=F('jogo__placar_fora'),
+        ).order_by().values('bilhete').annotate(total=Count('id')).values('total')
+
+        bilhetes = Bilhete.objects.all()
+        if options['bolao']:
+            bilhetes = bilhetes.filter(bolao_id=options['bolao'])
+        total = bilhetes.update(acertos=Coalesce(Subquery(acertos), 0))
+        self.stdout.write(self.style.SUCCESS(f'{total} bilhetes recalculados.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from bolao.models import Bolao
+
+
+class Command(BaseCommand):
+    help = 'Confere qtd_bilhetes e total_arrecadado dos bolões com a tabela de bilhetes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corrigir', action='store_true', help='Salva os valores corretos nos bolões divergentes.')
+
+    def handle(self, *args, **options):
+        divergentes = Bolao.verificar_contadores(corrigir=options['corrigir'])
+        for bolao in divergentes:
+            self.stdout.write(f'{bolao.codigo}: {bolao.qtd_bilhetes} bilhetes, {bolao.total_arrecadado} arrecadado')
+        acao = 'corrigidos' if options['corrigir'] else 'divergentes'
+        self.stdout.write(self.style.SUCCESS(f'{len(divergentes)} bolões {acao}.'))
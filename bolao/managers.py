@@ -0,0 +1,47 @@
+from django.db import models
+from django.utils import timezone
+
+from . import STATUS_BOLAO
+
+
+class BolaoQuerySet(models.QuerySet):
+
+    def por_status(self, status: str):
+        """
+        Filtra pelo status persistido, corrigido pelo horário do primeiro jogo.
+
+        Entre uma execução e outra do bolao.tasks.iniciar_boloes, bolões cujo primeiro jogo já começou
+        ainda podem estar como ATIVO ou PALPITES PAUSADOS.
+        """
+        agora = timezone.now()
+        antes_do_jogo = (STATUS_BOLAO['ATIVO'], STATUS_BOLAO['PALPITES PAUSADOS'])
+        if status in antes_do_jogo:
+            return self.filter(status=status).exclude(primeiro_jogo_em__lte=agora)
+        if status == STATUS_BOLAO['JOGO INICIADO']:
+            return self.filter(models.Q(status=status) |
+                               models.Q(status__in=antes_do_jogo, primeiro_jogo_em__lte=agora))
+        return self.filter(status=status)
+
+    def para_leitura(self):
+        """
+        Carrega tudo o que o BolaoSerializer usa com uma quantidade fixa de consultas por página.
+
+        Os jogos vêm com times e campeonato em um único prefetch e os bilhetes vencedores são buscados
+        apenas para bolões finalizados, em vencedores_prefetch. Os vencedores seguem a mesma regra do pagamento
+        (Bilhete.filtrar_vencedores), e não o contador Bilhete.acertos, que não vê placares lançados pelo admin.
+        """
+        from .models import Bilhete, Jogo
+
+        qtd_jogos = Jogo.objects.filter(boloes=models.OuterRef('bolao_id')).order_by().values(
+            'boloes').annotate(total=models.Count('id')).values('total')
+        vencedores = Bilhete.filtrar_vencedores(Bilhete.objects.filter(bolao__status=STATUS_BOLAO['FINALIZADO']),
+                                                models.Subquery(qtd_jogos)).select_related('usuario')
+        return self.prefetch_related(
+            models.Prefetch('jogos', queryset=Jogo.objects.select_related('campeonato', 'time_casa', 'time_fora')),
+            models.Prefetch('bilhetes', queryset=vencedores, to_attr='vencedores_prefetch'),
+        )
+
+    def iniciar(self) -> int:
+        """Muda para JOGO INICIADO os bolões cujo primeiro jogo já começou."""
+        return self.filter(status__in=(STATUS_BOLAO['ATIVO'], STATUS_BOLAO['PALPITES PAUSADOS']),
+                           primeiro_jogo_em__lte=timezone.now()).update(status=STATUS_BOLAO['JOGO INICIADO'])
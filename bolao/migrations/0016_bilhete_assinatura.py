@@ -0,0 +1,44 @@
+# Generated by Django 4.0 on 2026-10-18 09:19
+
+import hashlib
+from itertools import groupby
+
+from django.db import migrations, models
+
+TAMANHO_LOTE = 2000
+
+
+def gerar_assinaturas(apps, schema_editor):
+    # Mesmo cálculo de Bilhete.calcular_assinatura; modelos históricos não têm os métodos do modelo.
+    Bilhete = apps.get_model('bolao', 'Bilhete')
+    Palpite = apps.get_model('bolao', 'Palpite')
+    linhas = Palpite.objects.order_by('bilhete_id').values_list(
+        'bilhete_id', 'jogo_id', 'placar_casa', 'placar_fora').iterator(chunk_size=TAMANHO_LOTE)
+    lote = []
+    for bilhete_id, grupo in groupby(linhas, key=lambda linha: linha[0]):
+        chave = '|'.join(sorted(f'{jogo}:{casa}:{fora}' for _, jogo, casa, fora in grupo))
+        lote.append(Bilhete(id=bilhete_id, assinatura=hashlib.sha256(chave.encode()).hexdigest()))
+        if len(lote) >= TAMANHO_LOTE:
+            Bilhete.objects.bulk_update(lote, ['assinatura'])
+            lote = []
+    Bilhete.objects.bulk_update(lote, ['assinatura'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bolao', '0015_alter_bolao_jogos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bilhete',
+            name='assinatura',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Assinatura dos palpites'),
+        ),
+        migrations.AddIndex(
+            model_name='bilhete',
+            index=models.Index(fields=['bolao', 'assinatura'], name='bilhete_bolao_assinatura_idx'),
+        ),
+        migrations.RunPython(gerar_assinaturas, migrations.RunPython.noop),
+    ]
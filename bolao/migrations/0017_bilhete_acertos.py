@@ -0,0 +1,35 @@
+# Generated by Django 4.0 on 2026-10-18 09:22
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+STATUS_JOGO_FINALIZADO_API = ['FT', 'AET']
+
+
+def contar_acertos(apps, schema_editor):
+    Bilhete = apps.get_model('bolao', 'Bilhete')
+    Palpite = apps.get_model('bolao', 'Palpite')
+    acertos = Palpite.objects.filter(
+        bilhete=OuterRef('pk'),
+        jogo__status__in=STATUS_JOGO_FINALIZADO_API,
+        placar_casa=F('jogo__placar_casa'),
+        placar_fora=F('jogo__placar_fora'),
+    ).order_by().values('bilhete').annotate(total=Count('id')).values('total')
+    Bilhete.objects.update(acertos=Coalesce(Subquery(acertos), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bolao', '0016_bilhete_assinatura'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bilhete',
+            name='acertos',
+            field=models.PositiveIntegerField(default=0, verbose_name='Acertos'),
+        ),
+        migrations.RunPython(contar_acertos, migrations.RunPython.noop),
+    ]
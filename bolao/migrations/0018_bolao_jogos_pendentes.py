@@ -0,0 +1,31 @@
+# Generated by Django 4.0 on 2026-10-18 09:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+STATUS_JOGO_FINALIZADO_API = ['FT', 'AET']
+
+
+def contar_jogos_pendentes(apps, schema_editor):
+    Bolao = apps.get_model('bolao', 'Bolao')
+    pendentes = Bolao.jogos.through.objects.filter(bolao_id=OuterRef('pk')).exclude(
+        jogo__status__in=STATUS_JOGO_FINALIZADO_API).order_by().values('bolao_id').annotate(
+        total=Count('id')).values('total')
+    Bolao.objects.update(jogos_pendentes=Coalesce(Subquery(pendentes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bolao', '0017_bilhete_acertos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bolao',
+            name='jogos_pendentes',
+            field=models.PositiveIntegerField(default=0, verbose_name='Jogos pendentes'),
+        ),
+        migrations.RunPython(contar_jogos_pendentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0 on 2026-10-18 09:24
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def contar_bilhetes(apps, schema_editor):
+    Bolao = apps.get_model('bolao', 'Bolao')
+    Bilhete = apps.get_model('bolao', 'Bilhete')
+    qtd = Bilhete.objects.filter(bolao_id=OuterRef('pk')).order_by().values('bolao_id').annotate(
+        total=Count('id')).values('total')
+    Bolao.objects.update(qtd_bilhetes=Coalesce(Subquery(qtd), 0))
+    Bolao.objects.exclude(status='CANCELADO').update(total_arrecadado=F('qtd_bilhetes') * F('valor_palpite'))
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bolao', '0018_bolao_jogos_pendentes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bolao',
+            name='qtd_bilhetes',
+            field=models.PositiveIntegerField(default=0, verbose_name='Quantidade de bilhetes'),
+        ),
+        migrations.AddField(
+            model_name='bolao',
+            name='total_arrecadado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12, verbose_name='Total arrecadado'),
+        ),
+        migrations.RunPython(contar_bilhetes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0 on 2026-10-18 09:25
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def preencher_primeiro_jogo(apps, schema_editor):
+    Bolao = apps.get_model('bolao', 'Bolao')
+    Jogo = apps.get_model('bolao', 'Jogo')
+    primeiro = Jogo.objects.filter(boloes=OuterRef('pk')).order_by('data').values('data')[:1]
+    Bolao.objects.update(primeiro_jogo_em=Subquery(primeiro))
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bolao', '0019_bolao_contadores_bilhetes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bolao',
+            name='primeiro_jogo_em',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Início do primeiro jogo'),
+        ),
+        migrations.AddIndex(
+            model_name='bolao',
+            index=models.Index(fields=['status', 'primeiro_jogo_em'], name='bolao_status_inicio_idx'),
+        ),
+        migrations.RunPython(preencher_primeiro_jogo, migrations.RunPython.noop),
+    ]
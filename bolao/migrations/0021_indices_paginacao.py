@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-18 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bolao', '0020_bolao_primeiro_jogo_em'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bolao',
+            index=models.Index(fields=['created_at', 'id'], name='bolao_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='jogo',
+            index=models.Index(fields=['data', 'id'], name='jogo_data_id_idx'),
+        ),
+    ]
@@ -1,17 +1,22 @@
+import hashlib
 import os
-from decimal import Decimal
-from typing import List
+from decimal import ROUND_DOWN, Decimal
+from typing import Iterable, Iterator, List, Optional, Tuple
 from django.utils import timezone
 from django.db import models, transaction
+from django.db.models import Count, F, Min, OuterRef, Q, QuerySet, Subquery
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.core.exceptions import ValidationError
 
 from core.models import BaseModel
-from usuario.models import Usuario
+from usuario.models import Carteira, Usuario
 from . import VENCEDOR_CHOICES, STATUS_BOLAO, STATUS_JOGO_FINALIZADO_API
+from .managers import BolaoQuerySet
 
 from core.utils import gerar_codigo, get_taxa_banca
 
+CHUNK_BILHETES = 2000
+
 
 class Campeonato(BaseModel):
 
@@ -66,6 +71,7 @@ class Jogo(BaseModel):
         verbose_name = "Jogo"
         verbose_name_plural = "Jogos"
         ordering = ['-data', 'status']
+        indexes = [models.Index(fields=['data', 'id'], name='jogo_data_id_idx')]
 
     @property
     def placar(self):
@@ -80,7 +86,42 @@ class Jogo(BaseModel):
 
     @property
     def finalizado(self):
-        return self.status in STATUS_JOGO_FINALIZADO_API
+        return self.status in STATUS_JOGO_FINALIZADO_API.split('-')
+
+    def descontar_pendencias(self) -> List:
+        """
+        Desconta este jogo dos jogos pendentes de cada bolão e retorna os bolões que chegaram a zero.
+
+        As linhas ficam travadas até o fim da transação, então cada bolão é zerado por um único jogo.
+        """
+        boloes = Bolao.objects.select_for_update().filter(jogos=self, jogos_pendentes__gt=0)
+        zerados = [bolao_id for bolao_id, pendentes in boloes.values_list('id', 'jogos_pendentes') if pendentes == 1]
+        boloes.update(jogos_pendentes=F('jogos_pendentes') - 1)
+        return zerados
+
+    def placar_contabilizado(self) -> Optional[Tuple[int, int]]:
+        """Placar final que conta nos acertos dos bilhetes, None enquanto o jogo não terminou."""
+        if self.status in STATUS_JOGO_FINALIZADO_API.split('-') and \
+           self.placar_casa is not None and self.placar_fora is not None:
+            return self.placar_casa, self.placar_fora
+        return None
+
+    def atualizar_acertos(self, anterior: Optional[Tuple[int, int]]) -> None:
+        """
+        Atualiza o contador de acertos dos bilhetes com um UPDATE por placar.
+
+        :param anterior: placar_contabilizado() antes de salvar o resultado. Se o placar final mudou, os acertos
+                         do placar anterior são desfeitos antes de contar o novo.
+        """
+        atual = self.placar_contabilizado()
+        if anterior == atual:
+            return
+        if anterior is not None:
+            Bilhete.objects.filter(palpites__jogo=self, palpites__placar_casa=anterior[0],
+                                   palpites__placar_fora=anterior[1]).update(acertos=F('acertos') - 1)
+        if atual is not None:
+            Bilhete.objects.filter(palpites__jogo=self, palpites__placar_casa=atual[0],
+                                   palpites__placar_fora=atual[1]).update(acertos=F('acertos') + 1)
 
     def __str__(self):
         return f'{self.time_casa} vs {self.time_fora}'
@@ -101,37 +142,105 @@ class Bolao(BaseModel):
                                                  MinValueValidator(float(os.getenv('MIN_TAXA_CRIADOR')))])
     bilhetes_minimos = models.PositiveIntegerField("Palpites mínimos", default=0)
     status = models.CharField(max_length=20, choices=STATUS_BOLAO.items(), default=STATUS_BOLAO['ATIVO'])
+    jogos_pendentes = models.PositiveIntegerField("Jogos pendentes", default=0)
+    primeiro_jogo_em = models.DateTimeField("Início do primeiro jogo", null=True, blank=True)
+    qtd_bilhetes = models.PositiveIntegerField("Quantidade de bilhetes", default=0)
+    total_arrecadado = models.DecimalField("Total arrecadado", max_digits=12, decimal_places=2, default=Decimal(0))
+
+    CAMPOS_DENORMALIZADOS = ('jogos_pendentes', 'primeiro_jogo_em', 'qtd_bilhetes', 'total_arrecadado')
+
+    objects = BolaoQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Bolão'
         verbose_name_plural = 'Bolões'
-
-    def buscar_vencedores(self):
-        return [bilhete.usuario for bilhete in self.bilhetes.all() if bilhete.acertou]
+        indexes = [models.Index(fields=['status', 'primeiro_jogo_em'], name='bolao_status_inicio_idx'),
+                   models.Index(fields=['created_at', 'id'], name='bolao_created_id_idx')]
+
+    def bilhetes_vencedores(self) -> QuerySet:
+        """
+        Bilhetes que acertaram todos os palpites e cobrem todos os jogos.
+
+        Quando o resultado está completo e todos os bilhetes têm assinatura, a busca é uma igualdade indexada
+        pela assinatura do resultado; fora isso, cai na consulta agregada por acertos. O contador Bilhete.acertos
+        não decide pagamento: placares lançados fora de API.salvar_resultdo (ex.: admin) não passam por ele.
+        """
+        assinatura = self.assinatura_resultado()
+        if assinatura and not self.bilhetes.filter(assinatura__isnull=True).exists():
+            return self.bilhetes.filter(assinatura=assinatura)
+        return self.vencedores_por_acertos()
+
+    def bilhetes_vivos(self) -> QuerySet:
+        """Bilhetes que acertaram todos os jogos já finalizados do bolão."""
+        finalizados = self.jogos.filter(status__in=STATUS_JOGO_FINALIZADO_API.split('-')).count()
+        return self.bilhetes.filter(acertos=finalizados)
+
+    def vencedores_por_acertos(self) -> QuerySet:
+        """Bilhetes vencedores em uma única consulta agregada (Palpite x Jogo agrupado por bilhete)."""
+        return Bilhete.filtrar_vencedores(self.bilhetes.all(), self.jogos.count())
+
+    def assinatura_resultado(self) -> Optional[str]:
+        """Assinatura do placar real dos jogos, None enquanto algum jogo não tiver placar."""
+        resultados = list(self.jogos.values_list('id', 'placar_casa', 'placar_fora'))
+        if len(resultados) == 0 or any(casa is None or fora is None for _, casa, fora in resultados):
+            return None
+        return Bilhete.calcular_assinatura(resultados)
+
+    def atualizar_dados_jogos(self) -> None:
+        """Recalcula jogos_pendentes e primeiro_jogo_em a partir dos jogos do bolão."""
+        dados = self.jogos.aggregate(
+            pendentes=Count('id', filter=~Q(status__in=STATUS_JOGO_FINALIZADO_API.split('-'))),
+            primeiro=Min('data'))
+        self.jogos_pendentes, self.primeiro_jogo_em = dados['pendentes'], dados['primeiro']
+        Bolao.objects.filter(id=self.id).update(jogos_pendentes=self.jogos_pendentes,
+                                                primeiro_jogo_em=self.primeiro_jogo_em)
+
+    @classmethod
+    def atualizar_primeiro_jogo(cls, boloes: QuerySet) -> int:
+        """Recalcula primeiro_jogo_em dos bolões com um único UPDATE (ex.: jogo remarcado)."""
+        primeiro = Jogo.objects.filter(boloes=OuterRef('pk')).order_by('data').values('data')[:1]
+        return boloes.update(primeiro_jogo_em=Subquery(primeiro))
+
+    def registrar_bilhetes(self, quantidade: int = 1) -> None:
+        Bolao.objects.filter(id=self.id).update(
+            qtd_bilhetes=F('qtd_bilhetes') + quantidade,
+            total_arrecadado=F('total_arrecadado') + self.valor_palpite * quantidade)
+
+    def buscar_vencedores(self) -> List[Usuario]:
+        return [bilhete.usuario for bilhete in self.bilhetes_vencedores().select_related('usuario__carteira')]
 
     def retirar_banca_e_criador(self) -> Decimal:
         """Retorna o valor restante da subtração"""
-        total_bolao = self.bilhetes.count() * self.valor_palpite
+        total_bolao = self.qtd_bilhetes * self.valor_palpite
         valor_banca = Decimal(self.taxa_banca / 100).quantize(Decimal('.01')) * total_bolao
         valor_criador = Decimal(self.taxa_criador / 100).quantize(Decimal('.01')) * total_bolao
         self.criador.carteira.depositar(valor_criador)
-        banca = Usuario.objects.get(id=os.getenv('ID_CARTEIRA_BANCA'))
-        banca.carteira.depositar(valor_banca)
+        Carteira.movimentar_banca(valor_banca)
         return total_bolao - (valor_banca + valor_criador)
 
-    def pagar_vencedores(self, vencedores: List[Usuario]):
-        """Usar quando a vencedores."""
+    def carteiras_dos_bilhetes(self, bilhetes: QuerySet = None) -> Iterator:
+        """Carteira de cada bilhete (repetida se o usuário tem vários), lida em blocos do banco."""
+        bilhetes = self.bilhetes.all() if bilhetes is None else bilhetes
+        return bilhetes.values_list('usuario__carteira', flat=True).iterator(chunk_size=CHUNK_BILHETES)
+
+    @staticmethod
+    def ratear(liquido: Decimal, partes: int) -> Decimal:
+        """Cota de cada parte arredondada para baixo; os centavos que sobram da divisão vão para a banca."""
+        cota = (liquido / partes).quantize(Decimal('.01'), rounding=ROUND_DOWN)
+        sobra = liquido - cota * partes
+        if sobra > 0:
+            Carteira.movimentar_banca(sobra)
+        return cota
+
+    def pagar_vencedores(self, vencedores: List):
+        """Usar quando a vencedores. Recebe a carteira de cada bilhete vencedor."""
         liquido = self.retirar_banca_e_criador()
-        ganho = liquido / len(vencedores)
-        for vencedor in vencedores:
-            vencedor.carteira.depositar(ganho)
+        Carteira.depositar_em_lote(self.ratear(liquido, len(vencedores)), vencedores)
 
     def estornar_bolao(self):
         """Usar quando não a vencedores e estorno está ativado."""
         liquido = self.retirar_banca_e_criador()
-        ganho = liquido / self.bilhetes.count()
-        for bilhete in self.bilhetes.all():
-            bilhete.usuario.carteira.depositar(ganho)
+        Carteira.depositar_em_lote(self.ratear(liquido, self.qtd_bilhetes), self.carteiras_dos_bilhetes())
 
     def dividir_entre_banca_e_criador(self):
         """Usar quando não a vencedores e estorno não está ativado."""
@@ -139,17 +248,50 @@ class Bolao(BaseModel):
         self.criador.carteira.depositar(ganho)
 
     @transaction.atomic
-    def cancelar_bolao(self):
-        for bilhete in self.self.bilhetes.all():
-            bilhete.usuario.carteira.depositar(self.valor_palpite)
+    def cancelar_bolao(self) -> bool:
+        """Devolve o valor de cada bilhete. Retorna False se o bolão já estava finalizado ou cancelado."""
+        # Trava o bolão e relê o status para que dois cancelamentos, ou um cancelamento e uma finalização,
+        # concorrentes não devolvam ou paguem duas vezes.
+        self.status = Bolao.objects.select_for_update().values_list('status', flat=True).get(id=self.id)
+        if self.status in (STATUS_BOLAO['FINALIZADO'], STATUS_BOLAO['CANCELADO']):
+            return False
+        Carteira.depositar_em_lote(self.valor_palpite, self.carteiras_dos_bilhetes())
         self.status = STATUS_BOLAO['CANCELADO']
+        self.total_arrecadado = Decimal(0)
         self.save()
+        Bolao.objects.filter(id=self.id).update(total_arrecadado=self.total_arrecadado)
+        return True
+
+    @classmethod
+    def verificar_contadores(cls, corrigir: bool = False, boloes: QuerySet = None) -> List['Bolao']:
+        """
+        Compara qtd_bilhetes e total_arrecadado com a tabela de bilhetes em uma consulta agregada.
+
+        :return: Bolões divergentes, já com os valores corretos (salvos se corrigir=True).
+        """
+        boloes = cls.objects.all() if boloes is None else boloes
+        divergentes = []
+        boloes = boloes.annotate(qtd_real=Count('bilhetes')).only(
+            'id', 'codigo', 'status', 'valor_palpite', 'qtd_bilhetes', 'total_arrecadado')
+        for bolao in boloes.iterator(chunk_size=CHUNK_BILHETES):
+            total_real = bolao.qtd_real * bolao.valor_palpite
+            if bolao.status == STATUS_BOLAO['CANCELADO']:
+                total_real = Decimal(0)
+            if bolao.qtd_bilhetes != bolao.qtd_real or bolao.total_arrecadado != total_real:
+                bolao.qtd_bilhetes, bolao.total_arrecadado = bolao.qtd_real, total_real
+                divergentes.append(bolao)
+        if corrigir:
+            cls.objects.bulk_update(divergentes, ['qtd_bilhetes', 'total_arrecadado'], batch_size=CHUNK_BILHETES)
+        return divergentes
 
     @transaction.atomic
     def finalizar_bolao(self):
-        if self.jogos_finalizados and self.status != STATUS_BOLAO['FINALIZADO']:
-            vencedores = self.buscar_vencedores()
-            if self.bilhetes_minimos > self.bilhetes.count():
+        # Trava o bolão e relê status e contadores para que duas finalizações concorrentes não paguem duas vezes.
+        self.status, self.qtd_bilhetes, self.total_arrecadado = Bolao.objects.select_for_update().values_list(
+            'status', 'qtd_bilhetes', 'total_arrecadado').get(id=self.id)
+        if self.jogos_finalizados and self.status not in (STATUS_BOLAO['FINALIZADO'], STATUS_BOLAO['CANCELADO']):
+            vencedores = list(self.carteiras_dos_bilhetes(self.bilhetes_vencedores()))
+            if self.bilhetes_minimos > self.qtd_bilhetes:
                 self.cancelar_bolao()
                 self.status = STATUS_BOLAO['CANCELADO']
             elif len(vencedores) > 0:
@@ -165,14 +307,22 @@ class Bolao(BaseModel):
 
     @property
     def status_atualizado(self):
-        for jogo in self.jogos.all():
-            if jogo.data <= timezone.now():
-                return STATUS_BOLAO['JOGO INICIADO']
+        if self.status in (STATUS_BOLAO['ATIVO'], STATUS_BOLAO['PALPITES PAUSADOS']) and \
+           self.primeiro_jogo_em is not None and self.primeiro_jogo_em <= timezone.now():
+            return STATUS_BOLAO['JOGO INICIADO']
         return self.status
 
     @property
     def jogos_finalizados(self):
-        return any([jogo.finalizado for jogo in self.jogos.all()])
+        return not self.jogos.exclude(status__in=STATUS_JOGO_FINALIZADO_API.split('-')).exists()
+
+    def save(self, **kwargs) -> None:
+        # Os campos denormalizados são mantidos com UPDATEs próprios (F()/Subquery), então um save com a
+        # instância desatualizada não pode sobrescrevê-los.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.CAMPOS_DENORMALIZADOS]
+        return super().save(**kwargs)
 
     def __str__(self):
         return f'Aposta: {self.valor_palpite}|Código: {self.codigo}'
@@ -182,10 +332,40 @@ class Bilhete(BaseModel):
 
     usuario = models.ForeignKey(Usuario, verbose_name="Usuário", on_delete=models.PROTECT, related_name='bilhetes')
     bolao = models.ForeignKey(Bolao, verbose_name="Bolão", on_delete=models.PROTECT, related_name='bilhetes')
+    assinatura = models.CharField("Assinatura dos palpites", max_length=64, null=True, blank=True)
+    acertos = models.PositiveIntegerField("Acertos", default=0)
+
+    CAMPOS_DENORMALIZADOS = ('assinatura', 'acertos')
 
     class Meta:
         verbose_name = 'Bilhete'
         verbose_name_plural = 'Bilhetes'
+        indexes = [models.Index(fields=['bolao', 'assinatura'], name='bilhete_bolao_assinatura_idx')]
+
+    @staticmethod
+    def calcular_assinatura(palpites: Iterable[Tuple]) -> str:
+        """Hash determinístico das tuplas (jogo, placar_casa, placar_fora), independente da ordem."""
+        chave = '|'.join(sorted(f'{jogo}:{casa}:{fora}' for jogo, casa, fora in palpites))
+        return hashlib.sha256(chave.encode()).hexdigest()
+
+    @staticmethod
+    def filtrar_vencedores(bilhetes: QuerySet, qtd_jogos) -> QuerySet:
+        """
+        Bilhetes que acertaram todos os palpites e têm pelo menos qtd_jogos palpites.
+
+        :param qtd_jogos: quantidade de jogos do bolão, um inteiro ou uma expressão (ex.: Subquery por bolão).
+        """
+        acertos = Q(palpites__placar_casa=F('palpites__jogo__placar_casa'),
+                    palpites__placar_fora=F('palpites__jogo__placar_fora'))
+        return bilhetes.annotate(
+            qtd_acertos=Count('palpites', filter=acertos),
+            qtd_palpites=Count('palpites')
+        ).filter(qtd_acertos=F('qtd_palpites'), qtd_acertos__gte=qtd_jogos)
+
+    def atualizar_assinatura(self) -> str:
+        self.assinatura = self.calcular_assinatura(self.palpites.values_list('jogo_id', 'placar_casa', 'placar_fora'))
+        Bilhete.objects.filter(id=self.id).update(assinatura=self.assinatura)
+        return self.assinatura
 
     @property
     def acertou(self):
@@ -198,9 +378,35 @@ class Bilhete(BaseModel):
             raise ValidationError(f"Não é possível dar bilhetes pois o bolão {self.bolao.status.lower()}")
         return super().clean()
 
+    @transaction.atomic
     def save(self, **kwargs) -> None:
+        if not self._state.adding:
+            # Assinatura e acertos são mantidos por UPDATEs próprios, como os contadores de Bolao.
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                           if not field.primary_key and field.name not in self.CAMPOS_DENORMALIZADOS]
+            return super().save(**kwargs)
         self.usuario.carteira.saque(self.bolao.valor_palpite)
-        return super().save(**kwargs)
+        super().save(**kwargs)
+        self.bolao.registrar_bilhetes()
+
+    @classmethod
+    @transaction.atomic
+    def comprar_em_lote(cls, usuario: Usuario, bolao: Bolao,
+                        palpites_por_bilhete: List[List[Tuple]]) -> List['Bilhete']:
+        """
+        Compra um bilhete por lista de palpites (jogo, placar_casa, placar_fora) com um único débito na carteira e um
+        único lançamento no histórico. Bilhetes e palpites são inseridos com bulk_create.
+        """
+        usuario.carteira.saque(bolao.valor_palpite * len(palpites_por_bilhete))
+        bilhetes = [cls(usuario=usuario, bolao=bolao, assinatura=cls.calcular_assinatura(palpites))
+                    for palpites in palpites_por_bilhete]
+        cls.objects.bulk_create(bilhetes, batch_size=CHUNK_BILHETES)
+        Palpite.objects.bulk_create([Palpite(bilhete=bilhete, jogo_id=jogo, placar_casa=casa, placar_fora=fora)
+                                     for bilhete, palpites in zip(bilhetes, palpites_por_bilhete)
+                                     for jogo, casa, fora in palpites], batch_size=CHUNK_BILHETES)
+        bolao.registrar_bilhetes(len(bilhetes))
+        return bilhetes
 
     def __str__(self) -> str:
         return f'{self.usuario.nome_formatado}|{self.bolao}'
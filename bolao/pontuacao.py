@@ -0,0 +1,94 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .models import Bolao, Palpite, CHUNK_BILHETES
+
+SEM_PLACAR = -1
+
+
+def pontuar_faixa(bilhetes: np.ndarray, jogos: np.ndarray, casa: np.ndarray, fora: np.ndarray,
+                  real_casa: np.ndarray, real_fora: np.ndarray, inicio: int, fim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Acertos e quantidade de palpites dos bilhetes [inicio, fim) em uma única passada vetorizada."""
+    acertou = (casa == real_casa[jogos]) & (fora == real_fora[jogos])
+    deslocados = bilhetes - inicio
+    acertos = np.bincount(deslocados, weights=acertou, minlength=fim - inicio).astype(np.int32)
+    palpites = np.bincount(deslocados, minlength=fim - inicio).astype(np.int32)
+    return acertos, palpites
+
+
+class PontuacaoVetorizada:
+    """
+    Motor de pontuação em memória para bolões muito grandes.
+
+    Os palpites são lidos em blocos com values_list/iterator para arrays contíguos (índice do bilhete, índice do
+    jogo, placar casa, placar fora) e todos os bilhetes são pontuados de uma vez contra o vetor de resultados.
+    A regra é a mesma de Bolao.vencedores_por_acertos: vence quem acertou todos os palpites e cobre todos os jogos.
+    """
+
+    def __init__(self, bolao: Bolao):
+        self.bolao = bolao
+        self.ids_bilhetes: List = []
+        self.carregado = False
+
+    def carregar(self) -> 'PontuacaoVetorizada':
+        jogos = list(self.bolao.jogos.values_list('id', 'placar_casa', 'placar_fora'))
+        indice_jogos = {jogo_id: indice for indice, (jogo_id, _, _) in enumerate(jogos)}
+        self.real_casa = np.array([SEM_PLACAR if casa is None else casa for _, casa, _ in jogos], dtype=np.int32)
+        self.real_fora = np.array([SEM_PLACAR if fora is None else fora for _, _, fora in jogos], dtype=np.int32)
+
+        indice_bilhetes = {}
+        bilhetes, jogos_idx, casa, fora = array('i'), array('i'), array('i'), array('i')
+        linhas = Palpite.objects.filter(bilhete__bolao=self.bolao, jogo__in=indice_jogos.keys()).order_by(
+            'bilhete_id').values_list('bilhete_id', 'jogo_id', 'placar_casa', 'placar_fora').iterator(
+            chunk_size=CHUNK_BILHETES)
+        for bilhete_id, jogo_id, placar_casa, placar_fora in linhas:
+            if bilhete_id not in indice_bilhetes:
+                indice_bilhetes[bilhete_id] = len(indice_bilhetes)
+            bilhetes.append(indice_bilhetes[bilhete_id])
+            jogos_idx.append(indice_jogos[jogo_id])
+            casa.append(placar_casa)
+            fora.append(placar_fora)
+
+        self.ids_bilhetes = list(indice_bilhetes)
+        self.bilhetes = np.frombuffer(bilhetes, dtype=np.int32)
+        self.jogos = np.frombuffer(jogos_idx, dtype=np.int32)
+        self.casa = np.frombuffer(casa, dtype=np.int32)
+        self.fora = np.frombuffer(fora, dtype=np.int32)
+        self.carregado = True
+        return self
+
+    def faixas(self, partes: int) -> List[Tuple[int, int, int, int]]:
+        """Divide por faixa de bilhetes: (inicio, fim) em bilhetes e (de, ate) nas linhas ordenadas."""
+        total = len(self.ids_bilhetes)
+        limites = np.linspace(0, total, partes + 1, dtype=np.int64)
+        linhas = np.searchsorted(self.bilhetes, limites)
+        return [(int(limites[i]), int(limites[i + 1]), int(linhas[i]), int(linhas[i + 1]))
+                for i in range(partes) if limites[i] < limites[i + 1]]
+
+    def pontuar(self, processos: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Retorna (acertos, palpites) por bilhete, na ordem de ids_bilhetes."""
+        if not self.carregado:
+            self.carregar()
+        if processos <= 1 or len(self.ids_bilhetes) < processos:
+            return pontuar_faixa(self.bilhetes, self.jogos, self.casa, self.fora,
+                                 self.real_casa, self.real_fora, 0, len(self.ids_bilhetes))
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            futuros = [executor.submit(pontuar_faixa, self.bilhetes[de:ate], self.jogos[de:ate], self.casa[de:ate],
+                                       self.fora[de:ate], self.real_casa, self.real_fora, inicio, fim)
+                       for inicio, fim, de, ate in self.faixas(processos)]
+            resultados = [futuro.result() for futuro in futuros]
+        return (np.concatenate([acertos for acertos, _ in resultados]),
+                np.concatenate([palpites for _, palpites in resultados]))
+
+    def acertos_por_bilhete(self, processos: int = 1) -> Dict:
+        acertos, _ = self.pontuar(processos)
+        return dict(zip(self.ids_bilhetes, acertos.tolist()))
+
+    def vencedores(self, processos: int = 1) -> List:
+        """IDs dos bilhetes vencedores."""
+        acertos, palpites = self.pontuar(processos)
+        vencedores = np.flatnonzero((acertos == palpites) & (acertos >= len(self.real_casa)))
+        return [self.ids_bilhetes[indice] for indice in vencedores]
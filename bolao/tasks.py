@@ -1,11 +1,22 @@
+import logging
+import os
+import time
 from datetime import timedelta, timezone
-from celery import shared_task, current_app, Task
+import requests
+from celery import chord, shared_task, current_app, Task
 
 from django.utils import timezone as dj_timezone
-from bolao import STATUS_JOGO_FINALIZADO_API
+from bolao import STATUS_BOLAO, STATUS_JOGO_FINALIZADO_API
 from .models import Bolao, Campeonato, Jogo
+from core.custom_exception import CotaInsuficiente
 from core.network.football import API
 
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE_BOLOES = 50
+LISTAGENS_CATALOGO = ['api/v1/bolao/campeonato/', 'api/v1/bolao/time/', 'api/v1/bolao/jogo/',
+                      'api/v1/bolao/jogo/?status=NS']
+
 
 class BaseTaskWithRetry(Task):
     autoretry_for = (Exception, )
@@ -18,7 +29,11 @@ class BaseTaskWithRetry(Task):
 @shared_task(bind=True, base=BaseTaskWithRetry)
 def buscar_jogos(self):
     campeonatos = Campeonato.objects.filter(ativo=True)
-    criados = API.buscar_e_salvar_jogos(campeonatos)
+    try:
+        criados = API.buscar_e_salvar_jogos(campeonatos)
+    except CotaInsuficiente as exc:
+        # Tentar antes da renovação da cota só gasta tentativas; espera até a cota voltar.
+        raise self.retry(exc=exc, countdown=API.espera_cota())
 
     if len(criados) == 0:
         raise Exception()
@@ -27,27 +42,80 @@ def buscar_jogos(self):
         data_utc = jogo.data.astimezone(timezone.utc)
         eta = data_utc + timedelta(hours=2)
         current_app.send_task('bolao.tasks.conferir_resultado', args=(jogo.id_externo, ), eta=eta)
+    current_app.send_task('bolao.tasks.aquecer_cache_catalogo')
     return len(criados)  # Return a quantidade de Jogos adicionados.
 
 
 @shared_task(bind=True, base=BaseTaskWithRetry)
 def conferir_resultado(self, id_externo: str):
     jogo = Jogo.objects.get(id_externo=id_externo)
-    API.atualizar_resultados(jogo, many=False)
+    try:
+        API.atualizar_resultados(jogo, many=False)
+    except CotaInsuficiente as exc:
+        raise self.retry(exc=exc, countdown=API.espera_cota())
     jogo = Jogo.objects.get(id_externo=id_externo)
 
     if jogo.status not in STATUS_JOGO_FINALIZADO_API.split('-'):
         raise Exception()
 
-    current_app.send_task('bolao.tasks.finalizar_boloes', args=(jogo.id_externo, ))
+    current_app.send_task('bolao.tasks.aquecer_cache_catalogo')
+    # API.salvar_resultdo já enfileira a finalização dos bolões cujo último jogo pendente era este.
     return jogo.placar
 
 
 @shared_task
-def finalizar_boloes(id_externo: str):
-    boloes = Bolao.objects.filter(jogos__id_externo__in=[id_externo])
-    for bolao in boloes:
-        bolao.finalizar_bolao()
+def finalizar_boloes(id_externo: str = None):
+    """
+    Varredura periódica dos bolões sem jogos pendentes que ainda não foram finalizados nem cancelados.
+
+    `id_externo` é ignorado: só existe para que mensagens antigas, enfileiradas por jogo, virem uma varredura.
+
+    Cobre os bolões cuja finalização enfileirada por API.salvar_resultdo se perdeu ou falhou em finalizar_lote_boloes.
+    Bolao.finalizar_bolao trava o bolão e relê o status, então repetir um bolão já finalizado não paga duas vezes.
+    """
+    ids = Bolao.objects.filter(jogos_pendentes=0, primeiro_jogo_em__lte=dj_timezone.now()).exclude(
+        status__in=(STATUS_BOLAO['FINALIZADO'], STATUS_BOLAO['CANCELADO'])).values_list('id', flat=True)
+    return despachar_finalizacao([str(_id) for _id in ids], 'varredura')
+
+
+@shared_task
+def despachar_finalizacao(ids: list, id_externo: str):
+    """Divide os bolões em lotes e finaliza os lotes em paralelo entre os workers."""
+    if len(ids) == 0:
+        return 'Nenhum bolão para finalizar.'
+    lotes = [ids[count:count + TAMANHO_LOTE_BOLOES] for count in range(0, len(ids), TAMANHO_LOTE_BOLOES)]
+    chord(finalizar_lote_boloes.s(lote) for lote in lotes)(resumo_finalizacao.s(time.time(), id_externo))
+    return len(lotes)  # Return a quantidade de lotes despachados.
+
+
+@shared_task
+def finalizar_lote_boloes(ids: list):
+    finalizados, falhas = 0, []
+    for bolao in Bolao.objects.filter(id__in=ids):
+        try:
+            bolao.finalizar_bolao()
+            finalizados += 1
+        except Exception:
+            logger.exception('Falha ao finalizar o bolão %s.', bolao.id)
+            falhas.append(str(bolao.id))
+    return {'finalizados': finalizados, 'falhas': falhas}
+
+
+@shared_task
+def resumo_finalizacao(resultados: list, inicio: float, id_externo: str):
+    falhas = [_id for resultado in resultados for _id in resultado['falhas']]
+    return {
+        'jogo': id_externo,
+        'finalizados': sum(resultado['finalizados'] for resultado in resultados),
+        'falhas': len(falhas),
+        'boloes_com_falha': falhas,
+        'duracao': round(time.time() - inicio, 3),
+    }
+
+
+@shared_task
+def iniciar_boloes():
+    return Bolao.objects.iniciar()  # Return a quantidade de bolões que mudaram para JOGO INICIADO.
 
 
 @shared_task
@@ -56,7 +124,19 @@ def atualizar_resultados_antigos():
         now = dj_timezone.now()
         jogos = Jogo.objects.filter(data=now + timedelta(hours=12))
         API.atualizar_resultados(jogos, many=True)
-        for jogo in jogos:
-            current_app.send_task('bolao.tasks.finalizar_boloes', args=(jogo.id_externo, ))
+        current_app.send_task('bolao.tasks.aquecer_cache_catalogo')
     except IndexError:
         return 'Jogos não encontrados, veja manualmente.'
+
+
+@shared_task
+def aquecer_cache_catalogo():
+    """Pré-renderiza as listagens mais acessadas do catálogo depois de uma sincronização."""
+    url_api = os.getenv('URL_API')
+    if not url_api:
+        return 'URL_API não configurada.'
+    aquecidas = 0
+    for listagem in LISTAGENS_CATALOGO:
+        response = requests.get(url_api.rstrip('/') + '/' + listagem, timeout=30)
+        aquecidas += response.status_code == 200
+    return aquecidas  # Return a quantidade de listagens aquecidas.
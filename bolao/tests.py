@@ -1,8 +1,28 @@
-from django.test import TestCase
+import os
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+from celery.exceptions import Retry
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
 from decimal import Decimal
 from django.core.exceptions import ValidationError
-from .models import Campeonato, Time, Jogo, Bolao, Bilhete
+from django.contrib.admin import site
+from . import STATUS_BOLAO, tasks
+from .admin import BolaoAdmin, CampeonatoAdmin, JogoAdmin, PalpiteAdmin
+from .models import Campeonato, Time, Jogo, Bolao, Bilhete, Palpite
+from .pontuacao import PontuacaoVetorizada
 from datetime import datetime, timedelta
+from core.cache import invalidar_catalogo
+from core.custom_exception import CotaInsuficiente
+from core.network.football import API
+from usuario.models import Carteira
 from usuario.factories.usuario import CarteiraFactory, EnderecoFactory, PermissoesNotificacaoFactory, UsuarioFactory
 
 
@@ -94,6 +114,202 @@ class BolaoModelTestCase(TestCase):
         palpite2.palpites.create(jogo=self.jogo2, placar_casa=1, placar_fora=1)
         vencedores = bolao.buscar_vencedores()
         self.assertEqual(vencedores, [usuario1])
+        carteiras = list(bolao.carteiras_dos_bilhetes(bolao.bilhetes_vencedores()))
+        self.assertEqual(carteiras, [usuario1.carteira_id])
+
+    def test_bilhetes_vencedores_exige_todos_os_jogos(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1, self.jogo2)
+        completo = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        completo.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        completo.palpites.create(jogo=self.jogo2, placar_casa=2, placar_fora=1)
+        incompleto = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        incompleto.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        self.assertEqual(list(bolao.bilhetes_vencedores()), [completo])
+
+    def test_bilhetes_vencedores_por_assinatura(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1, self.jogo2)
+        vencedor = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        vencedor.palpites.create(jogo=self.jogo2, placar_casa=2, placar_fora=1)
+        vencedor.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        perdedor = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        perdedor.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        perdedor.palpites.create(jogo=self.jogo2, placar_casa=0, placar_fora=0)
+        vencedor.atualizar_assinatura()
+        call_command('gerar_assinaturas_bilhetes', stdout=StringIO())
+        perdedor.refresh_from_db()
+        self.assertIsNotNone(perdedor.assinatura)
+        self.assertEqual(vencedor.assinatura, bolao.assinatura_resultado())
+        with self.assertNumQueries(3):
+            self.assertEqual(list(bolao.bilhetes_vencedores()), [vencedor])
+
+    def test_vencedor_anterior_aos_contadores(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1, self.jogo2)
+        Jogo.objects.filter(id__in=[self.jogo1.id, self.jogo2.id]).update(status='FT')
+        vencedor = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        vencedor.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        vencedor.palpites.create(jogo=self.jogo2, placar_casa=2, placar_fora=1)
+        Bilhete.objects.filter(id=vencedor.id).update(acertos=0, assinatura=None)
+        self.assertEqual(list(bolao.bilhetes_vencedores()), [vencedor])
+
+        import_module('bolao.migrations.0016_bilhete_assinatura').gerar_assinaturas(apps, None)
+        import_module('bolao.migrations.0017_bilhete_acertos').contar_acertos(apps, None)
+        vencedor.refresh_from_db()
+        self.assertEqual((vencedor.acertos, vencedor.assinatura), (2, bolao.assinatura_resultado()))
+        self.assertEqual(list(bolao.bilhetes_vencedores()), [vencedor])
+
+    def test_pontuacao_vetorizada(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1, self.jogo2)
+        vencedor = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        vencedor.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        vencedor.palpites.create(jogo=self.jogo2, placar_casa=2, placar_fora=1)
+        perdedor = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        perdedor.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        perdedor.palpites.create(jogo=self.jogo2, placar_casa=0, placar_fora=0)
+        motor = PontuacaoVetorizada(bolao)
+        self.assertEqual(motor.vencedores(), [vencedor.id])
+        self.assertEqual(motor.acertos_por_bilhete(), {vencedor.id: 2, perdedor.id: 1})
+        self.assertEqual(motor.vencedores(processos=2), [vencedor.id])
+
+    def test_atualizar_acertos_por_resultado(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1, self.jogo2)
+        bilhete = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        bilhete.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        bilhete.palpites.create(jogo=self.jogo2, placar_casa=2, placar_fora=1)
+
+        anterior = self.jogo1.placar_contabilizado()
+        self.jogo1.status = 'FT'
+        self.jogo1.save()
+        self.jogo1.atualizar_acertos(anterior)
+        bilhete.refresh_from_db()
+        self.assertEqual(bilhete.acertos, 1)
+        self.assertEqual(list(bolao.bilhetes_vivos()), [bilhete])
+
+        # Correção de placar desfaz o acerto anterior.
+        anterior = self.jogo1.placar_contabilizado()
+        self.jogo1.placar_casa = 3
+        self.jogo1.save()
+        self.jogo1.atualizar_acertos(anterior)
+        bilhete.refresh_from_db()
+        self.assertEqual(bilhete.acertos, 0)
+
+        Bilhete.objects.filter(id=bilhete.id).update(acertos=7)
+        call_command('recalcular_acertos_bilhetes', stdout=StringIO())
+        bilhete.refresh_from_db()
+        self.assertEqual(bilhete.acertos, 0)
+
+    def test_acertos_com_resultado_repetido(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1, self.jogo2)
+        bilhete = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        bilhete.palpites.create(jogo=self.jogo1, placar_casa=1, placar_fora=0)
+        bilhete.palpites.create(jogo=self.jogo2, placar_casa=0, placar_fora=0)
+        resultado = {'score': {'fulltime': {'home': 1, 'away': 0}}, 'fixture': {'status': {'short': 'FT'}}}
+        # Duas conferências do mesmo jogo com instâncias lidas antes do resultado.
+        for copia in [Jogo.objects.get(id=self.jogo1.id), Jogo.objects.get(id=self.jogo1.id)]:
+            API.salvar_resultdo(resultado, copia)
+        bilhete.refresh_from_db()
+        self.assertEqual(bilhete.acertos, 1)
+        self.assertEqual(list(bolao.bilhetes_vivos()), [bilhete])
+
+    def test_jogos_pendentes(self):
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1, self.jogo2)
+        bolao.atualizar_dados_jogos()
+        self.assertEqual(bolao.jogos_pendentes, 2)
+        resultado = {'score': {'fulltime': {'home': 1, 'away': 0}}, 'fixture': {'status': {'short': 'FT'}}}
+        API.salvar_resultdo(resultado, self.jogo1)
+        API.salvar_resultdo(resultado, self.jogo1)
+        bolao.refresh_from_db()
+        self.assertEqual(bolao.jogos_pendentes, 1)
+        self.assertFalse(bolao.jogos_finalizados)
+        self.assertEqual(self.jogo2.descontar_pendencias(), [bolao.id])
+        self.assertEqual(self.jogo2.descontar_pendencias(), [])
+
+    def test_contadores_de_bilhetes(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bilhete = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        bilhete.save()
+        bolao.save()
+        bolao.refresh_from_db()
+        self.assertEqual(bolao.qtd_bilhetes, 2)
+        self.assertEqual(bolao.total_arrecadado, Decimal('20.00'))
+        usuario.carteira.refresh_from_db()
+        self.assertEqual(usuario.carteira.saldo, Decimal('30.00'))
+
+        Bolao.objects.filter(id=bolao.id).update(qtd_bilhetes=5)
+        self.assertEqual(Bolao.verificar_contadores(corrigir=True), [bolao])
+        self.assertEqual(Bolao.verificar_contadores(), [])
+
+    def test_iniciar_boloes(self):
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(self.jogo1)
+        bolao.atualizar_dados_jogos()
+        self.assertEqual(bolao.status_atualizado, STATUS_BOLAO['ATIVO'])
+        self.assertEqual(Bolao.objects.iniciar(), 0)
+
+        Jogo.objects.filter(id=self.jogo1.id).update(data=datetime.now() - timedelta(minutes=1))
+        Bolao.atualizar_primeiro_jogo(Bolao.objects.filter(jogos=self.jogo1))
+        self.assertEqual(list(Bolao.objects.por_status(STATUS_BOLAO['JOGO INICIADO'])), [bolao])
+        self.assertEqual(list(Bolao.objects.por_status(STATUS_BOLAO['ATIVO'])), [])
+        self.assertEqual(Bolao.objects.iniciar(), 1)
+        bolao.refresh_from_db()
+        self.assertEqual(bolao.status, STATUS_BOLAO['JOGO INICIADO'])
+
+    def test_cancelar_bolao_devolve_bilhetes(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        self.assertTrue(bolao.cancelar_bolao())
+        usuario.carteira.refresh_from_db()
+        self.assertEqual(usuario.carteira.saldo, Decimal('50.00'))
+        self.assertEqual(bolao.status, STATUS_BOLAO['CANCELADO'])
+
+        # Uma cópia lida antes do cancelamento não devolve os bilhetes de novo.
+        copia = Bolao.objects.get(id=bolao.id)
+        copia.status = STATUS_BOLAO['ATIVO']
+        self.assertFalse(copia.cancelar_bolao())
+        usuario.carteira.refresh_from_db()
+        self.assertEqual(usuario.carteira.saldo, Decimal('50.00'))
+
+    def test_cancelar_bolao_finalizado(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
+        Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        Bolao.objects.filter(id=bolao.id).update(status=STATUS_BOLAO['FINALIZADO'])
+        self.assertFalse(bolao.cancelar_bolao())
+        usuario.carteira.refresh_from_db()
+        self.assertEqual(usuario.carteira.saldo, Decimal('40.00'))
+        self.assertEqual(bolao.status, STATUS_BOLAO['FINALIZADO'])
+
+    def test_rateio_nao_paga_mais_que_o_liquido(self):
+        banca = CarteiraFactory()
+        with mock.patch.dict(os.environ, {'ID_CARTEIRA_BANCA': str(banca.id)}):
+            saldo_banca = Carteira.saldo_banca()
+            self.assertEqual(Bolao.ratear(Decimal('10.00'), 6), Decimal('1.66'))
+            self.assertEqual(Carteira.saldo_banca() - saldo_banca, Decimal('0.04'))
 
     def test_buscar_vencedores_without_palpites(self):
         bolao = Bolao.objects.create(criador=self.criador, valor_palpite=Decimal('10.00'))
@@ -117,3 +333,348 @@ class BolaoModelTestCase(TestCase):
         palpite1.palpites.create(jogo=self.jogo2, placar_casa=2, placar_fora=1)
         palpite2.palpites.create(jogo=self.jogo1, placar_casa=0, placar_fora=0)
 '''
+
+
+class BolaoViewSetTestCase(TestCase):
+
+    def setUp(self):
+        self.usuario = UsuarioFactory(permissoes=PermissoesNotificacaoFactory(email_verificado=True))
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        campeonato = Campeonato.objects.create(nome="Campeonato A", pais="Brasil", temporada_atual="2023")
+        self.times = [Time.objects.create(nome=f"Time {i}", id_externo=str(i), logo=f"https://localhost:8000/{i}")
+                      for i in range(4)]
+        self.jogos = [Jogo.objects.create(id_externo=str(i), time_casa=self.times[i], time_fora=self.times[i + 1],
+                                          status="FT", data=datetime.now() - timedelta(days=1), placar_casa=1,
+                                          placar_fora=0, campeonato=campeonato) for i in range(3)]
+
+    def criar_boloes(self, quantidade):
+        for _ in range(quantidade):
+            bolao = Bolao.objects.create(criador=self.usuario, valor_palpite=Decimal('10.00'),
+                                         status=STATUS_BOLAO['FINALIZADO'])
+            bolao.jogos.add(*self.jogos)
+            bilhete = Bilhete.objects.create(usuario=self.usuario, bolao=bolao)
+            for jogo in self.jogos:
+                bilhete.palpites.create(jogo=jogo, placar_casa=1, placar_fora=0)
+
+    def test_listagem_com_consultas_constantes(self):
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        self.criar_boloes(2)
+        with CaptureQueriesContext(connection) as poucos:
+            response = self.client.get('/api/v1/bolao/bolao/', {'status': STATUS_BOLAO['FINALIZADO'], 'contar': 'true'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(poucos), 4)  # count, página, jogos com times e campeonato, vencedores
+        self.assertEqual(response.data['results'][0]['vencedores'], [self.usuario.nome_formatado])
+
+        self.criar_boloes(6)
+        with self.assertNumQueries(len(poucos)):
+            response = self.client.get('/api/v1/bolao/bolao/', {'status': STATUS_BOLAO['FINALIZADO'], 'contar': 'true'})
+        self.assertEqual(response.data['count'], 8)
+
+    def test_vencedores_com_resultado_lancado_no_admin(self):
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        bolao = Bolao.objects.create(criador=self.usuario, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(*self.jogos)
+        jogos = Jogo.objects.filter(id__in=[jogo.id for jogo in self.jogos])
+        jogos.update(status='NS', placar_casa=None, placar_fora=None)
+        vencedor = Bilhete.objects.create(usuario=self.usuario, bolao=bolao)
+        perdedor = Bilhete.objects.create(usuario=self.usuario, bolao=bolao)
+        for jogo in self.jogos:
+            vencedor.palpites.create(jogo=jogo, placar_casa=2, placar_fora=2)
+            perdedor.palpites.create(jogo=jogo, placar_casa=1, placar_fora=0)
+
+        request = mock.Mock(user=self.usuario)
+        for jogo in jogos:
+            jogo.status, jogo.placar_casa, jogo.placar_fora = 'FT', 2, 2
+            JogoAdmin(Jogo, site).save_model(request, jogo, None, True)
+        vencedor.refresh_from_db()
+        self.assertEqual(vencedor.acertos, len(self.jogos))
+
+        with mock.patch.dict(os.environ, {'ID_CARTEIRA_BANCA': str(CarteiraFactory().id)}):
+            bolao.finalizar_bolao()
+        self.assertEqual(bolao.status, STATUS_BOLAO['FINALIZADO'])
+        self.assertEqual(list(bolao.bilhetes_vencedores()), [vencedor])
+        response = self.client.get(f'/api/v1/bolao/bolao/{bolao.id}/')
+        self.assertEqual(response.data['vencedores'], [self.usuario.nome_formatado])
+        response = self.client.get('/api/v1/bolao/bolao/', {'status': STATUS_BOLAO['FINALIZADO']})
+        self.assertEqual(response.data['results'][0]['vencedores'], [self.usuario.nome_formatado])
+
+    def test_jogos_paginados_por_cursor(self):
+        response = self.client.get('/api/v1/bolao/jogo/', {'limit': 2})
+        self.assertNotIn('count', response.data)
+        ids = [jogo['id'] for jogo in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [jogo['id'] for jogo in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertCountEqual(ids, [str(jogo.id) for jogo in self.jogos])
+
+        # Todos os jogos têm o mesmo status; o id desempata e nenhuma página repete ou pula jogos.
+        response = self.client.get('/api/v1/bolao/jogo/', {'limit': 1, 'ordering': 'status'})
+        ids = [jogo['id'] for jogo in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [jogo['id'] for jogo in response.data['results']]
+        self.assertEqual(sorted(ids), sorted(str(jogo.id) for jogo in self.jogos))
+
+    @override_settings(CACHE_CATALOGO=True)
+    def test_cache_do_catalogo_por_versao(self):
+        cache.clear()
+        resposta = self.client.get('/api/v1/bolao/time/')
+        Time.objects.filter(id=self.times[0].id).update(nome='Renomeado')
+        self.assertEqual(self.client.get('/api/v1/bolao/time/').data, resposta.data)
+        invalidar_catalogo()
+        nomes = [time['nome'] for time in self.client.get('/api/v1/bolao/time/').data['results']]
+        self.assertIn('Renomeado', nomes)
+
+        self.assertEqual(len(self.client.get('/api/v1/bolao/campeonato/').data['results']), 1)
+        CampeonatoAdmin(Campeonato, site).desativar_campeonatos(None, Campeonato.objects.all())
+        self.assertEqual(self.client.get('/api/v1/bolao/campeonato/').data['results'], [])
+
+    def test_etag_jogos_e_bolao(self):
+        cache.clear()
+        response = self.client.get('/api/v1/bolao/jogo/')
+        etag = response['ETag']
+        response = self.client.get('/api/v1/bolao/jogo/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertGreater(int(response['X-Economia-Bytes']), 0)
+        self.assertGreaterEqual(float(response['X-Economia-Ms']), 0)
+        self.jogos[0].placar_casa = 2
+        self.jogos[0].save()
+        self.assertEqual(self.client.get('/api/v1/bolao/jogo/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Com o cache do catálogo ligado, o ETag da listagem vem só da versão do catálogo.
+        with override_settings(CACHE_CATALOGO=True):
+            etag = self.client.get('/api/v1/bolao/jogo/')['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get('/api/v1/bolao/jogo/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            invalidar_catalogo()
+            self.assertEqual(self.client.get('/api/v1/bolao/jogo/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        self.criar_boloes(1)
+        bolao = Bolao.objects.get()
+        url = f'/api/v1/bolao/bolao/{bolao.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Bilhete.objects.create(usuario=self.usuario, bolao=bolao)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def comprar_bilhete(self, bolao, jogos):
+        palpites = [{'jogo': str(jogo.id), 'placar_casa': 1, 'placar_fora': 0} for jogo in jogos]
+        return self.client.post('/api/v1/bolao/bilhete/', {'bolao': str(bolao.id), 'palpites': palpites},
+                                format='json')
+
+    def test_compra_de_bilhete_com_consultas_constantes(self):
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        futuros = [Jogo.objects.create(id_externo=f'futuro{i}', time_casa=self.times[0], time_fora=self.times[1],
+                                       data=datetime.now() + timedelta(days=1), campeonato=self.jogos[0].campeonato)
+                   for i in range(15)]
+        pequeno = Bolao.objects.create(criador=self.usuario, valor_palpite=Decimal('10.00'))
+        pequeno.jogos.add(futuros[0])
+        grande = Bolao.objects.create(criador=self.usuario, valor_palpite=Decimal('10.00'))
+        grande.jogos.add(*futuros)
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.comprar_bilhete(pequeno, futuros[:1]).status_code, 200)
+        with self.assertNumQueries(len(consultas)):
+            self.assertEqual(self.comprar_bilhete(grande, futuros).status_code, 200)
+        # bolão, jogos, débito, histórico, bilhete, palpites e contadores; o resto são savepoints.
+        dados = [consulta for consulta in consultas if 'SAVEPOINT' not in consulta['sql']]
+        self.assertEqual(len(dados), 7)
+        bilhete = grande.bilhetes.get()
+        self.assertEqual(bilhete.palpites.count(), 15)
+        self.assertEqual(bilhete.assinatura, Bilhete.calcular_assinatura(
+            bilhete.palpites.values_list('jogo_id', 'placar_casa', 'placar_fora')))
+
+        self.assertEqual(self.comprar_bilhete(grande, futuros[1:]).status_code, 400)
+        self.assertEqual(self.comprar_bilhete(pequeno, futuros[:2]).status_code, 400)
+        self.assertEqual(grande.bilhetes.count(), 1)
+
+    def bolao_futuro(self, quantidade=2):
+        futuros = [Jogo.objects.create(id_externo=f'futuro{i}', time_casa=self.times[0], time_fora=self.times[1],
+                                       data=datetime.now() + timedelta(days=1), campeonato=self.jogos[0].campeonato)
+                   for i in range(quantidade)]
+        bolao = Bolao.objects.create(criador=self.usuario, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(*futuros)
+        return bolao, futuros
+
+    def test_compra_com_carteira_esvaziada_depois_da_validacao(self):
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        bolao, futuros = self.bolao_futuro()
+        # A validação vê saldo; uma compra ou saque concorrente esvazia a carteira antes do débito.
+        Carteira.objects.filter(id=self.usuario.carteira_id).update(saldo=Decimal('5.00'))
+        with mock.patch.object(Carteira, 'saque_valido', return_value=True):
+            response = self.comprar_bilhete(bolao, futuros)
+        self.assertEqual(response.status_code, 402)
+        self.assertIn('message', response.data)
+        self.assertEqual(bolao.bilhetes.count(), 0)
+
+    def test_compra_em_lote_com_carteira_bloqueada_depois_da_validacao(self):
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        bolao, futuros = self.bolao_futuro()
+        Carteira.objects.filter(id=self.usuario.carteira_id).update(bloqueado=True)
+        bilhetes = [{'palpites': [{'jogo': str(jogo.id), 'placar_casa': 1, 'placar_fora': 0} for jogo in futuros]}]
+        with mock.patch.object(Carteira, 'saque_valido', return_value=True):
+            response = self.client.post('/api/v1/bolao/bilhete/comprar-lote/',
+                                        {'bolao': str(bolao.id), 'bilhetes': bilhetes}, format='json')
+        self.assertEqual(response.status_code, 402)
+        self.assertIn('message', response.data)
+        self.assertEqual(bolao.bilhetes.count(), 0)
+
+    def test_compra_de_bilhetes_em_lote(self):
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        futuros = [Jogo.objects.create(id_externo=f'futuro{i}', time_casa=self.times[0], time_fora=self.times[1],
+                                       data=datetime.now() + timedelta(days=1), campeonato=self.jogos[0].campeonato)
+                   for i in range(2)]
+        bolao = Bolao.objects.create(criador=self.usuario, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(*futuros)
+        bilhetes = [{'palpites': [{'jogo': str(jogo.id), 'placar_casa': placar, 'placar_fora': 0}
+                                  for jogo in futuros]} for placar in range(3)]
+        historico = self.usuario.carteira.historico_transacao.count()
+
+        dados = {'bolao': str(bolao.id), 'bilhetes': bilhetes}
+        response = self.client.post('/api/v1/bolao/bilhete/comprar-lote/', dados, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+        self.usuario.carteira.refresh_from_db()
+        self.assertEqual(self.usuario.carteira.saldo, Decimal('70.00'))
+        self.assertEqual(self.usuario.carteira.historico_transacao.count(), historico + 1)
+        bolao.refresh_from_db()
+        self.assertEqual((bolao.qtd_bilhetes, bolao.total_arrecadado), (3, Decimal('30.00')))
+        self.assertEqual(Palpite.objects.filter(bilhete__bolao=bolao).count(), 6)
+
+        dados = {'bolao': str(bolao.id), 'bilhetes': bilhetes[:1] * (settings.MAX_BILHETES_LOTE + 1)}
+        response = self.client.post('/api/v1/bolao/bilhete/comprar-lote/', dados, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bilhetes', response.data)
+        self.assertEqual(bolao.bilhetes.count(), 3)
+
+        bilhetes[1]['palpites'].pop()
+        dados = {'bolao': str(bolao.id), 'bilhetes': bilhetes}
+        response = self.client.post('/api/v1/bolao/bilhete/comprar-lote/', dados, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(bolao.bilhetes.count(), 3)
+
+
+class FinalizacaoTasksTestCase(TestCase):
+
+    def setUp(self):
+        criador = UsuarioFactory()
+        self.boloes = [Bolao.objects.create(criador=criador, valor_palpite=Decimal('10.00')) for _ in range(3)]
+
+    def test_despachar_em_lotes(self):
+        ids = [str(i) for i in range(tasks.TAMANHO_LOTE_BOLOES * 2 + 1)]
+        with mock.patch('bolao.tasks.chord') as chord:
+            self.assertEqual(tasks.despachar_finalizacao(ids, '10'), 3)
+        lotes = [assinatura.args[0] for assinatura in chord.call_args.args[0]]
+        self.assertEqual([len(lote) for lote in lotes], [tasks.TAMANHO_LOTE_BOLOES, tasks.TAMANHO_LOTE_BOLOES, 1])
+        self.assertEqual(tasks.despachar_finalizacao([], '10'), 'Nenhum bolão para finalizar.')
+
+    def test_varredura_de_boloes_sem_jogos_pendentes(self):
+        inicio = datetime.now() - timedelta(hours=3)
+        pendente, finalizado, sem_jogos = self.boloes
+        Bolao.objects.filter(id__in=[pendente.id, finalizado.id]).update(primeiro_jogo_em=inicio)
+        Bolao.objects.filter(id=finalizado.id).update(status=STATUS_BOLAO['FINALIZADO'])
+        with mock.patch('bolao.tasks.despachar_finalizacao') as despachar:
+            tasks.finalizar_boloes()
+            tasks.finalizar_boloes('10')
+        self.assertEqual(despachar.call_args_list, [mock.call([str(pendente.id)], 'varredura')] * 2)
+
+    def test_cota_insuficiente_espera_a_renovacao(self):
+        with mock.patch.object(API, 'buscar_e_salvar_jogos', side_effect=CotaInsuficiente()), \
+                mock.patch.object(API, 'espera_cota', return_value=321), \
+                mock.patch.object(tasks.buscar_jogos, 'retry', side_effect=Retry()) as retry:
+            with self.assertRaises(Retry):
+                tasks.buscar_jogos.run()
+        self.assertEqual(retry.call_args.kwargs['countdown'], 321)
+
+    def test_lote_registra_falhas_e_resumo(self):
+        falho = self.boloes[0]
+
+        def finalizar_bolao(bolao):
+            if bolao.id == falho.id:
+                raise ValueError('erro no pagamento')
+
+        with mock.patch.object(Bolao, 'finalizar_bolao', finalizar_bolao), \
+                self.assertLogs('bolao.tasks', level='ERROR') as logs:
+            resultado = tasks.finalizar_lote_boloes([str(bolao.id) for bolao in self.boloes])
+        self.assertEqual(resultado, {'finalizados': 2, 'falhas': [str(falho.id)]})
+        self.assertIn('erro no pagamento', logs.output[0])
+
+        resumo = tasks.resumo_finalizacao([resultado, {'finalizados': 4, 'falhas': []}], 0, '10')
+        self.assertEqual((resumo['jogo'], resumo['finalizados'], resumo['falhas']), ('10', 6, 1))
+        self.assertEqual(resumo['boloes_com_falha'], [str(falho.id)])
+
+
+class BolaoAdminTestCase(TestCase):
+
+    def test_resultado_lancado_no_admin(self):
+        campeonato = Campeonato.objects.create(nome="Campeonato A", pais="Brasil", temporada_atual="2023")
+        times = [Time.objects.create(nome=f"Time {i}", id_externo=str(i), logo=f"https://localhost:8000/{i}")
+                 for i in range(2)]
+        jogos = [Jogo.objects.create(id_externo=str(i), time_casa=times[0], time_fora=times[1], status='NS',
+                                     data=datetime.now() + timedelta(days=1), campeonato=campeonato) for i in range(2)]
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bolao = Bolao.objects.create(criador=usuario, valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(*jogos)
+        bolao.atualizar_dados_jogos()
+        bilhete = Bilhete.objects.create(usuario=usuario, bolao=bolao)
+        for jogo in jogos:
+            bilhete.palpites.create(jogo=jogo, placar_casa=1, placar_fora=0)
+
+        admin = JogoAdmin(Jogo, site)
+        with mock.patch('core.network.football.current_app') as celery:
+            with self.captureOnCommitCallbacks(execute=True):
+                for jogo in jogos:
+                    jogo.status, jogo.placar_casa, jogo.placar_fora = 'FT', 1, 0
+                    admin.save_model(mock.Mock(), jogo, None, True)
+        bolao.refresh_from_db()
+        bilhete.refresh_from_db()
+        self.assertEqual((bolao.jogos_pendentes, bilhete.acertos), (0, 2))
+        celery.send_task.assert_called_once_with('bolao.tasks.despachar_finalizacao', args=([str(bolao.id)], '1'))
+
+        # Desfazer o resultado devolve o jogo aos pendentes.
+        jogos[1].status = 'NS'
+        admin.save_model(mock.Mock(), jogos[1], None, True)
+        bolao.refresh_from_db()
+        self.assertEqual(bolao.jogos_pendentes, 1)
+
+    def test_jogo_remarcado_no_admin(self):
+        campeonato = Campeonato.objects.create(nome="Campeonato A", pais="Brasil", temporada_atual="2023")
+        time = Time.objects.create(nome="Time A", id_externo="1", logo="https://localhost:8000/1")
+        jogo = Jogo.objects.create(id_externo="1", time_casa=time, time_fora=time, status='NS',
+                                   data=datetime.now() + timedelta(days=1), campeonato=campeonato)
+        bolao = Bolao.objects.create(criador=UsuarioFactory(), valor_palpite=Decimal('10.00'))
+        bolao.jogos.add(jogo)
+        bolao.atualizar_dados_jogos()
+
+        jogo.data = datetime.now() - timedelta(minutes=1)
+        JogoAdmin(Jogo, site).save_model(mock.Mock(), jogo, None, True)
+        bolao.refresh_from_db()
+        self.assertEqual(bolao.primeiro_jogo_em, jogo.data)
+        self.assertEqual(bolao.status_atualizado, STATUS_BOLAO['JOGO INICIADO'])
+
+    def test_contadores_somente_leitura(self):
+        criador = UsuarioFactory()
+        bolao = Bolao.objects.create(criador=criador, valor_palpite=Decimal('10.00'))
+        request = mock.Mock(user=mock.Mock(has_perm=mock.Mock(return_value=True)))
+        campos = BolaoAdmin(Bolao, site).get_form(request, bolao).base_fields
+        for campo in Bolao.CAMPOS_DENORMALIZADOS:
+            self.assertNotIn(campo, campos)
+
+    def test_campos_do_bilhete_somente_leitura(self):
+        usuario = UsuarioFactory()
+        usuario.carteira.depositar(Decimal('50.00'))
+        bilhete = Bilhete.objects.create(usuario=usuario, bolao=Bolao.objects.create(
+            criador=usuario, valor_palpite=Decimal('10.00')))
+        request = mock.Mock(user=mock.Mock(has_perm=mock.Mock(return_value=True)))
+        campos = PalpiteAdmin(Bilhete, site).get_form(request, bilhete).base_fields
+        for campo in Bilhete.CAMPOS_DENORMALIZADOS:
+            self.assertNotIn(campo, campos)
+
+        Bilhete.objects.filter(id=bilhete.id).update(acertos=2)
+        bilhete.save()
+        bilhete.refresh_from_db()
+        self.assertEqual(bilhete.acertos, 2)
@@ -1,6 +1,7 @@
-import os
 from decimal import Decimal
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Subquery
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
@@ -12,6 +13,11 @@ from core.models import HistoricoTransacao
 from core.network.asaas import Cobranca
 
 
+def saldo_da_carteira(carteira_id) -> Subquery:
+    """Saldo lido pelo próprio UPDATE do lançamento, e não o da carteira em memória, que pode estar desatualizado."""
+    return Subquery(Carteira.objects.filter(id=carteira_id).values('saldo')[:1])
+
+
 class PaymentsWebhook(WebhookActionMixin, APIView):
     permission_classes = [AllowAny, ]
 
@@ -25,16 +31,15 @@ class PaymentsWebhook(WebhookActionMixin, APIView):
         if transacao.status == STATUS_HISTORICO['PENDING']:
             transacao.carteira.depositar(valor=Decimal(self.request.data['payment']['value']),
                                          externo=True, is_webhook=True)
-            transacao.status = STATUS_HISTORICO['CONFIRMED']
-            transacao.save()
+            transacao.efetivar(saldo_da_carteira(transacao.carteira_id), status=STATUS_HISTORICO['CONFIRMED'])
         try:
-            carteira_banca = Carteira.objects.get(id=os.getenv('ID_CARTEIRA_BANCA'))
             valor = Decimal(self.request.data['payment']['value']) - Decimal(self.request.data['payment']['netValue'])
-            carteira_banca.saque(valor=valor, externo=True, is_webhook=True)
-            HistoricoTransacao.objects.create(status=STATUS_HISTORICO['CONFIRMED'], carteira=carteira_banca,
+            carteira_banca = Carteira.movimentar_banca(-valor, externo=True, salvar_historico=False)
+            HistoricoTransacao.objects.create(status=STATUS_HISTORICO['CONFIRMED'], carteira_id=carteira_banca,
                                               valor=valor, externo=True,
                                               tipo=HistoricoTransacao.get_type(valor=-valor, externo=True),
-                                              asaas_infos=transacao.asaas_infos)
+                                              asaas_infos=transacao.asaas_infos,
+                                              saldo_apos=Carteira.saldo_banca_subconsulta(carteira_banca))
         except ObjectDoesNotExist:
             pass
         return status.HTTP_200_OK
@@ -64,10 +69,9 @@ class TransfersWebhook(WebhookActionMixin, APIView):
             )
         except ObjectDoesNotExist:
             return status.HTTP_200_OK
-        transacao.carteira.depositar(valor=self.request.data['transfer']['value'],
+        transacao.carteira.depositar(valor=Decimal(str(self.request.data['transfer']['value'])),
                                      externo=True, is_webhook=True)
-        transacao.status = STATUS_HISTORICO['FAILED']
-        transacao.save()
+        transacao.efetivar(saldo_da_carteira(transacao.carteira_id), status=STATUS_HISTORICO['FAILED'])
         return status.HTTP_200_OK
 
     def transfer_done(self):
@@ -79,4 +83,6 @@ class TransfersWebhook(WebhookActionMixin, APIView):
             return status.HTTP_200_OK
         transacao.status = STATUS_HISTORICO['CONFIRMED']
         transacao.save()
+        # Sem movimentação de saldo aqui; atualiza a carteira para invalidar o resumo do extrato.
+        Carteira.objects.filter(id=transacao.carteira_id).update(updated_at=timezone.now())
         return status.HTTP_200_OK
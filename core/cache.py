@@ -0,0 +1,21 @@
+from django.core.cache import cache
+
+CHAVE_VERSAO_CATALOGO = 'catalogo:versao'
+
+
+def versao_catalogo() -> int:
+    """Versão atual do catálogo (campeonatos, times e jogos), usada nas chaves do cache de respostas."""
+    versao = cache.get(CHAVE_VERSAO_CATALOGO)
+    if versao is None:
+        cache.add(CHAVE_VERSAO_CATALOGO, 1, timeout=None)
+        versao = cache.get(CHAVE_VERSAO_CATALOGO, 1)
+    return versao
+
+
+def invalidar_catalogo() -> int:
+    """Incrementa a versão do catálogo; as respostas da versão anterior deixam de ser usadas e expiram sozinhas."""
+    try:
+        return cache.incr(CHAVE_VERSAO_CATALOGO)
+    except ValueError:
+        cache.add(CHAVE_VERSAO_CATALOGO, 2, timeout=None)
+        return cache.get(CHAVE_VERSAO_CATALOGO, 2)
@@ -34,3 +34,17 @@ class UnavailableService(BaseException):
     def __init__(self, message="Serviço indisponível no momento.") -> None:
         self.message = message
         super().__init__(self.message)
+
+
+class CotaInsuficiente(BaseException):
+
+    def __init__(self, message="Cota da API de futebol insuficiente no momento.") -> None:
+        self.message = message
+        super().__init__(self.message)
+
+
+class LimiteProvedorExcedido(UnavailableService):
+
+    def __init__(self, message="Muitas requisições ao provedor, tente novamente em instantes.") -> None:
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,61 @@
+# Generated by Django 4.0 on 2026-10-18 09:36
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, F, Q, Value, When, Window
+from django.db.models.functions import Abs
+import django.utils.timezone
+
+TAMANHO_LOTE = 2000
+
+
+def preencher_efetivado_em(apps, schema_editor):
+    HistoricoTransacao = apps.get_model('core', 'HistoricoTransacao')
+    HistoricoTransacao.objects.update(efetivado_em=F('created_at'))
+    HistoricoTransacao.objects.filter(tipo='DEPOSITO', status__in=['PENDING', 'REMOVED']).update(efetivado_em=None)
+
+
+def preencher_saldo_apos(apps, schema_editor):
+    # Soma acumulada por carteira do mesmo efeito de HistoricoTransacao.efeito_no_saldo, na ordem de efetivação.
+    HistoricoTransacao = apps.get_model('core', 'HistoricoTransacao')
+    efeito = Case(
+        When(Q(tipo__in=['DEPOSITO', 'GANHO'], status='CONFIRMED'), then=Abs('valor')),
+        When(Q(tipo__in=['COMPRA', 'SAQUE'], status__in=['CONFIRMED', 'PENDING']), then=-Abs('valor')),
+        default=Value(Decimal(0)), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+    saldos = HistoricoTransacao.objects.filter(efetivado_em__isnull=False).annotate(
+        saldo=Window(models.Sum(efeito), partition_by=[F('carteira_id')], order_by=[F('efetivado_em'), F('id')])
+    ).values_list('id', 'saldo').iterator(chunk_size=TAMANHO_LOTE)
+    lote = []
+    for historico_id, saldo in saldos:
+        lote.append(HistoricoTransacao(id=historico_id, saldo_apos=saldo))
+        if len(lote) >= TAMANHO_LOTE:
+            HistoricoTransacao.objects.bulk_update(lote, ['saldo_apos'])
+            lote = []
+    HistoricoTransacao.objects.bulk_update(lote, ['saldo_apos'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_historicotransacao_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicotransacao',
+            name='efetivado_em',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True, verbose_name='Efetivado em'),
+        ),
+        migrations.AddField(
+            model_name='historicotransacao',
+            name='saldo_apos',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Saldo após a transação'),
+        ),
+        migrations.RunPython(preencher_efetivado_em, migrations.RunPython.noop),
+        migrations.RunPython(preencher_saldo_apos, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='historicotransacao',
+            index=models.Index(fields=['carteira', 'efetivado_em'], name='historico_carteira_efetivo_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_historico_saldo_apos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicotransacao',
+            index=models.Index(fields=['carteira', 'status', 'created_at'], name='historico_carteira_status_idx'),
+        ),
+    ]
@@ -1,6 +1,13 @@
+import hashlib
+import time
+from typing import Optional
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.response import Response
 from rest_framework import status
 
+from core.cache import versao_catalogo
+
 
 class WebhookActionMixin:
 
@@ -9,3 +16,84 @@ class WebhookActionMixin:
         handler = getattr(self, event.lower(), lambda: status.HTTP_200_OK)
         _status = handler()
         return Response(status=_status)
+
+
+class CacheCatalogoMixin:
+    """
+    Cache das respostas de list/retrieve de viewsets somente leitura do catálogo.
+
+    A chave é o caminho com os query params e a versão do catálogo, que é incrementada a cada sincronização com a
+    API de futebol e a cada edição no admin, então a invalidação é exata. Só fica ativo com settings.CACHE_CATALOGO.
+    """
+
+    cache_timeout = 60 * 60 * 24
+
+    def chave_cache(self, request) -> str:
+        return f'catalogo:{versao_catalogo()}:{self.basename}:{self.action}:{request.get_full_path()}'
+
+    def resposta_em_cache(self, request, acao, *args, **kwargs):
+        if not settings.CACHE_CATALOGO:
+            return acao(request, *args, **kwargs)
+        chave = self.chave_cache(request)
+        dados = cache.get(chave)
+        if dados is None:
+            response = acao(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            dados = response.data
+            cache.set(chave, dados, self.cache_timeout)
+        return Response(dados)
+
+    def list(self, request, *args, **kwargs):
+        return self.resposta_em_cache(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.resposta_em_cache(request, super().retrieve, *args, **kwargs)
+
+
+class ETagMixin:
+    """
+    GET condicional (ETag / If-None-Match) para list e retrieve.
+
+    A view define versao_etag() a partir de max(updated_at) e contagens, sem serializar nada; quando o cliente já tem a
+    versão atual a resposta é 304 sem corpo. Os headers X-Economia-Bytes e X-Economia-Ms informam o tamanho da última
+    resposta completa com o mesmo ETag e o tempo dela descontado o de versao_etag(), que o 304 também gasta.
+    """
+
+    etag_timeout = 60 * 60 * 24
+
+    def versao_etag(self) -> Optional[str]:
+        """Retorna None quando a ação não suporta ETag."""
+        return None
+
+    def resposta_condicional(self, request, acao, *args, **kwargs):
+        self.etag = None
+        inicio = time.perf_counter()
+        versao = self.versao_etag()
+        if versao is None:
+            return acao(request, *args, **kwargs)
+        self.etag = '"%s"' % hashlib.md5(f'{request.get_full_path()}|{versao}'.encode()).hexdigest()
+        if self.etag in [etag.strip() for etag in request.headers.get('If-None-Match', '').split(',')]:
+            economia = cache.get(f'etag:{self.etag}', {'bytes': 0, 'ms': 0})
+            gasto = (time.perf_counter() - inicio) * 1000
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': self.etag, 'X-Economia-Bytes': str(economia['bytes']),
+                                     'X-Economia-Ms': str(max(0, round(economia['ms'] - gasto, 2)))})
+        self.inicio_etag = inicio
+        return acao(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = self.etag
+            response.render()
+            cache.set(f'etag:{self.etag}', {'bytes': len(response.content),
+                                            'ms': round((time.perf_counter() - self.inicio_etag) * 1000, 2)},
+                      self.etag_timeout)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.resposta_condicional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.resposta_condicional(request, super().retrieve, *args, **kwargs)
@@ -1,8 +1,13 @@
 from decimal import Decimal
+from typing import Any, Dict, List
 from uuid import uuid4
 from django.db import models
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Abs
+from django.utils import timezone
 
 from core.network.asaas import Cobranca
+from core.custom_exception import UnavailableService
 
 from . import TIPO_CHOICES, STATUS_HISTORICO
 
@@ -28,7 +33,10 @@ class AsaasInformations(BaseModel):
     billet_url = models.CharField("URL do boleto", max_length=150, blank=True, null=True)
 
     def get_pix_infos(self) -> dict:
-        status, infos = Cobranca.get_pix(self.asaas_id)
+        try:
+            status, infos = Cobranca.get_pix(self.asaas_id)
+        except UnavailableService:
+            status = False
         if status:
             return infos
         return {
@@ -52,10 +60,39 @@ class HistoricoTransacao(BaseModel):
                               related_name='historico_transacao', blank=True, null=True)
     asaas_infos = models.ForeignKey(AsaasInformations, on_delete=models.CASCADE,
                                     related_name='historico_transacao', blank=True, null=True)
+    saldo_apos = models.DecimalField('Saldo após a transação', max_digits=12, decimal_places=2, blank=True, null=True)
+    efetivado_em = models.DateTimeField('Efetivado em', default=timezone.now, blank=True, null=True)
 
     class Meta:
         verbose_name = 'Transação'
         verbose_name_plural = 'Histórico transações'
+        indexes = [models.Index(fields=['carteira', 'efetivado_em'], name='historico_carteira_efetivo_idx'),
+                   models.Index(fields=['carteira', 'status', 'created_at'], name='historico_carteira_status_idx')]
+
+    @staticmethod
+    def efeito_no_saldo():
+        """
+        Expressão com o efeito de cada lançamento no saldo da carteira. O sinal de `valor` não é uniforme entre os
+        fluxos, então vale o tipo: créditos contam quando confirmados e débitos já saem da carteira enquanto pendentes
+        (saques); saques que falharam foram devolvidos e cobranças removidas nunca entraram.
+        """
+        return Case(
+            When(Q(tipo__in=['DEPOSITO', 'GANHO'], status=STATUS_HISTORICO['CONFIRMED']), then=Abs('valor')),
+            When(Q(tipo__in=['COMPRA', 'SAQUE'],
+                   status__in=[STATUS_HISTORICO['CONFIRMED'], STATUS_HISTORICO['PENDING']]), then=-Abs('valor')),
+            default=Value(Decimal(0)), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+
+    def efetivar(self, saldo, **campos) -> None:
+        """
+        Carimba o saldo resultante quando o efeito do lançamento acontece depois da criação (webhooks).
+
+        :param saldo: valor ou expressão; os webhooks passam uma subconsulta na carteira para gravar o saldo da linha.
+        """
+        self.saldo_apos = saldo
+        self.efetivado_em = timezone.now()
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+        self.save()
 
     @classmethod
     def get_type(cls, valor: Decimal, externo: bool):
@@ -68,5 +105,16 @@ class HistoricoTransacao(BaseModel):
         else:
             return 'GANHO'
 
+    @classmethod
+    def registrar_em_lote(cls, lancamentos: Dict[Any, Decimal], externo: bool = False, saldos: Dict = None,
+                          batch_size: int = 1000) -> List['HistoricoTransacao']:
+        """Insere um lançamento por carteira ({carteira_id: valor}) com bulk_create."""
+        saldos = saldos or {}
+        return cls.objects.bulk_create([
+            cls(carteira_id=carteira_id, valor=valor, externo=externo, saldo_apos=saldos.get(carteira_id),
+                tipo=cls.get_type(valor=valor, externo=externo))
+            for carteira_id, valor in lancamentos.items()
+        ], batch_size=batch_size)
+
     def __str__(self) -> str:
         return f'{self.tipo} - {self.status} => {self.valor}'
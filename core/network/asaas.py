@@ -3,9 +3,13 @@ from typing import Union, Dict, Any
 from decimal import Decimal
 from datetime import date
 from dateutil.relativedelta import relativedelta
-import requests
+from core.network.http import ClienteHTTP
+from core.network.limitador import balde
 from core.utils import clean_cpf
 
+# Sem retry automático: POST de cobrança e transferência não é idempotente.
+cliente = ClienteHTTP('asaas', timeout=40, tentativas=0, limitador=balde('asaas'), espera_maxima=10)
+
 
 class Customer:
 
@@ -27,7 +31,7 @@ class Customer:
         if kwargs:
             payload.update(kwargs)
 
-        response = requests.post(url=url, headers=headers, json=payload, timeout=40)
+        response = cliente.post(url, headers=headers, json=payload)
         return response.status_code == 200, response.json()
 
     @classmethod
@@ -38,7 +42,7 @@ class Customer:
             "access_token": os.getenv('ASAAS_KEY')
         }
 
-        response = requests.delete(url, headers=headers, timeout=40)
+        response = cliente.delete(url, headers=headers)
         return response.status_code == 200
 
 
@@ -60,7 +64,7 @@ class Cobranca:
             "dueDate": (date.today() + relativedelta(days=1)).strftime('%Y-%m-%d'),
             "externalReference": transaction_id
         }
-        response = requests.post(url, headers=headers, json=payload, timeout=40)
+        response = cliente.post(url, headers=headers, json=payload)
         return response.status_code == 200, response.json()
 
     @classmethod
@@ -71,7 +75,7 @@ class Cobranca:
             "content-type": "application/json",
             "access_token": os.getenv('ASAAS_KEY')
         }
-        response = requests.get(url, headers=headers, timeout=40)
+        response = cliente.get(url, headers=headers)
         return response.status_code == 200, response.json()
 
     @classmethod
@@ -82,7 +86,7 @@ class Cobranca:
             "access_token": os.getenv('ASAAS_KEY')
         }
 
-        response = requests.delete(url, headers=headers, timeout=40)
+        response = cliente.delete(url, headers=headers)
         return response.status_code == 200
 
 
@@ -111,7 +115,7 @@ class Transferencia:
             "content-type": "application/json",
             "access_token": os.getenv('ASAAS_KEY')
         }
-        response = requests.post(url=url, headers=headers, json=payload, timeout=40)
+        response = cliente.post(url, headers=headers, json=payload)
         return response.status_code == 200, response.json()
 
     @classmethod
@@ -121,5 +125,5 @@ class Transferencia:
             "accept": "application/json",
             "access_token": os.getenv('ASAAS_KEY')
         }
-        response = requests.get(url, headers=headers)
+        response = cliente.get(url, headers=headers)
         return response.status_code == 200, response.json()
@@ -1,27 +1,116 @@
-from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+import hashlib
 import os
-from typing import List, Union
-import requests
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlencode
+from celery import current_app
 from django.utils import timezone
+from django.core.cache import cache
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import QuerySet
 
+from core.cache import invalidar_catalogo
+from core.custom_exception import CotaInsuficiente
+from core.network.http import ClienteHTTP
+from core.network.limitador import balde
 from bolao import VENCEDOR_CHOICES, STATUS_JOGO_FINALIZADO_API
-from bolao.models import Campeonato, Jogo, Time
+from bolao.models import Bolao, Campeonato, Jogo, Time
+
+TAMANHO_LOTE_UPSERT = 500
 
 
 class API:
     api_using = 'IO'
     url = "https://v3.football.api-sports.io/"
     headers = {"x-apisports-key": os.getenv("KEY_FOOTBALL_API_IO")}
+    cliente = ClienteHTTP('football', limitador=balde('football'))
+    # Requisições simultâneas na busca de jogos; ajustar conforme a cota por minuto do plano contratado.
+    concorrencia = int(os.getenv('FOOTBALL_API_CONCORRENCIA', 4))
+    # Segundos que cada resposta fica em cache, por endpoint; resultados de jogos usam TTL_RESULTADOS.
+    ttl_respostas = {'leagues': 60 * 60 * 6, 'fixtures': 60 * 10}
+    TTL_RESULTADOS = 60
+    # Requisições diárias guardadas para a conferência de resultados.
+    reserva_cota = int(os.getenv('FOOTBALL_API_RESERVA_COTA', 10))
+
+    # buscar_jogos roda nas threads de buscar_e_salvar_jogos e pode trocar de provedor: a troca e a leitura de url e
+    # headers em consultar são feitas sob este lock, então nenhuma requisição mistura os dois provedores.
+    troca_provedor = threading.Lock()
 
     @classmethod
     def set_rapid_api(cls):
-        setattr(cls, 'api_using', 'RAPID_API')
-        setattr(cls, 'url', "https://api-football-v1.p.rapidapi.com/v3/")
-        setattr(cls, 'headers', {"x-rapidapi-host": "v3.football.api-sports.io",
-                                 "x-rapidapi-key": os.getenv('KEY_FOOTBALL_DATA')})
+        with cls.troca_provedor:
+            setattr(cls, 'api_using', 'RAPID_API')
+            setattr(cls, 'url', "https://api-football-v1.p.rapidapi.com/v3/")
+            setattr(cls, 'headers', {"x-rapidapi-host": "v3.football.api-sports.io",
+                                     "x-rapidapi-key": os.getenv('KEY_FOOTBALL_DATA')})
+
+    @classmethod
+    def consultar(cls, endpoint: str, params: dict, ttl: int = None,
+                  reserva: int = None) -> Tuple[int, Optional[list]]:
+        """
+        GET no endpoint com cache da resposta por endpoint e parâmetros. Só vai ao provedor em cache miss e, antes
+        disso, levanta CotaInsuficiente se a cota registrada pelos headers da última resposta estiver no fim; a
+        conferência de resultados passa reserva=0 para usar as requisições guardadas por reserva_cota.
+        """
+        consulta = f'{endpoint}?{urlencode(sorted(params.items()))}'
+        chave = f'football:resposta:{hashlib.md5(consulta.encode()).hexdigest()}'
+        dados = cache.get(chave)
+        if dados is not None:
+            return 200, dados
+        if cls.cota_baixa(reserva):
+            raise CotaInsuficiente()
+        with cls.troca_provedor:
+            url, headers = cls.url, cls.headers
+        response = cls.cliente.get(url + endpoint, headers=headers, params=params)
+        cls.registrar_cota(response.headers)
+        if response.status_code != 200:
+            return response.status_code, None
+        dados = response.json()["response"]
+        cache.set(chave, dados, cls.ttl_respostas.get(endpoint, cls.TTL_RESULTADOS) if ttl is None else ttl)
+        return 200, dados
+
+    @classmethod
+    def registrar_cota(cls, headers) -> None:
+        """Guarda a cota informada pelo provedor (limites diário e por minuto) para o provedor em uso."""
+        campos = {'dia_restante': 'x-ratelimit-requests-remaining', 'dia_limite': 'x-ratelimit-requests-limit',
+                  'minuto_restante': 'x-ratelimit-remaining', 'minuto_limite': 'x-ratelimit-limit'}
+        cota = {campo: int(headers[header]) for campo, header in campos.items()
+                if str(headers.get(header, '')).isdigit()}
+        if cota:
+            cache.set(f'football:cota:{cls.api_using}', {**cota, 'atualizado_em': timezone.now()}, 60 * 60 * 24)
+
+    @classmethod
+    def cota(cls) -> Optional[Dict]:
+        return cache.get(f'football:cota:{cls.api_using}')
+
+    @classmethod
+    def cota_baixa(cls, reserva: int = None) -> bool:
+        """True quando restam `reserva` requisições no dia ou a cota do minuto corrente acabou."""
+        cota = cls.cota()
+        if not cota:
+            return False
+        reserva = cls.reserva_cota if reserva is None else reserva
+        if cota.get('dia_restante', reserva + 1) <= reserva:
+            return True
+        return cota.get('minuto_restante') == 0 and timezone.now() - cota['atualizado_em'] < timedelta(minutes=1)
+
+    @classmethod
+    def espera_cota(cls) -> int:
+        """
+        Segundos até a cota voltar: o fim do minuto corrente quando só a cota por minuto acabou; senão a virada do
+        dia em UTC, quando o provedor renova a cota diária.
+        """
+        cota = cls.cota() or {}
+        agora = timezone.now()
+        if cota.get('minuto_restante') == 0 and agora - cota['atualizado_em'] < timedelta(minutes=1):
+            return int((cota['atualizado_em'] + timedelta(minutes=1) - agora).total_seconds()) + 1
+        agora_utc = datetime.now(dt_timezone.utc)
+        amanha = (agora_utc + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return int((amanha - agora_utc).total_seconds()) + 1
 
     @staticmethod
     def get_current(seasons: List[dict]) -> str:
@@ -32,9 +121,8 @@ class API:
     @classmethod
     def buscar_e_salvar_competicoes(cls):
         params = {"country": "Brazil"}
-        response = requests.get(cls.url + 'leagues', headers=cls.headers, params=params)
-        if response.status_code == 200:
-            competicoes = response.json()["response"]
+        status, competicoes = cls.consultar('leagues', params)
+        if status == 200:
 
             campeonatos = []
             for competicao in competicoes:
@@ -63,6 +151,7 @@ class API:
             Campeonato.objects.bulk_create(campeonatos,
                                            update_fields=['temporada_atual', 'logo'],
                                            unique_fields=['id_externo'])
+            invalidar_catalogo()
             return True
         if cls.api_using == 'RAPID_API':
             return False
@@ -71,32 +160,47 @@ class API:
 
     @classmethod
     def salvar_jogo(cls, jogo: dict, campeonato: Campeonato) -> Jogo:
-        time_casa = cls.salvar_time(jogo["teams"]["home"]["id"], jogo["teams"]["home"]["name"],
-                                    jogo["teams"]["home"]["logo"])
-        time_fora = cls.salvar_time(jogo["teams"]["away"]["id"], jogo["teams"]["away"]["name"],
-                                    jogo["teams"]["away"]["logo"])
-
-        id_externo = jogo["fixture"]["id"]
-        status = jogo["fixture"]["status"]["short"]
-        data = timezone.datetime.strptime(jogo["fixture"]["date"], "%Y-%m-%dT%H:%M:%S-03:00")
-        placar_casa = jogo["goals"]["home"]
-        placar_fora = jogo["goals"]["away"]
-        vencedor = cls.obter_vencedor(placar_casa, placar_fora)
-
-        new_jogo, _ = Jogo.objects.update_or_create(
-            id_externo=id_externo,
-            defaults={
-                "time_casa": time_casa,
-                "time_fora": time_fora,
-                "status": status,
-                "data": data,
-                "placar_casa": placar_casa,
-                "placar_fora": placar_fora,
-                "vencedor": vencedor,
-                "campeonato": campeonato,
-            }
-        )
-        return new_jogo
+        return cls.salvar_jogos([(jogo, campeonato)])[0]
+
+    @classmethod
+    def salvar_jogos(cls, fixtures: List[Tuple[dict, Campeonato]]) -> List[Jogo]:
+        """
+        Grava um lote de fixtures com dois upserts (bulk_create com update_conflicts em id_externo): um para os times
+        e outro para os jogos. As FKs dos times saem de um mapa id_externo -> id lido uma única vez.
+
+        Em jogos já existentes, status e placar não são sobrescritos: o resultado é de salvar_resultdo, que desconta
+        as pendências dos bolões e enfileira a finalização.
+        """
+        times = {}
+        for jogo, _ in fixtures:
+            for lado in ('home', 'away'):
+                time = jogo["teams"][lado]
+                times[str(time["id"])] = Time(id_externo=str(time["id"]), nome=time["name"], logo=time["logo"])
+        Time.objects.bulk_create(times.values(), batch_size=TAMANHO_LOTE_UPSERT, update_conflicts=True,
+                                 unique_fields=['id_externo'], update_fields=['nome', 'logo', 'updated_at'])
+        ids_times = dict(Time.objects.filter(id_externo__in=times.keys()).values_list('id_externo', 'id'))
+
+        jogos = {}
+        for jogo, campeonato in fixtures:
+            placar_casa = jogo["goals"]["home"]
+            placar_fora = jogo["goals"]["away"]
+            jogos[str(jogo["fixture"]["id"])] = Jogo(
+                id_externo=str(jogo["fixture"]["id"]),
+                time_casa_id=ids_times[str(jogo["teams"]["home"]["id"])],
+                time_fora_id=ids_times[str(jogo["teams"]["away"]["id"])],
+                status=jogo["fixture"]["status"]["short"],
+                data=timezone.datetime.strptime(jogo["fixture"]["date"], "%Y-%m-%dT%H:%M:%S-03:00"),
+                placar_casa=placar_casa,
+                placar_fora=placar_fora,
+                vencedor=cls.obter_vencedor(placar_casa, placar_fora),
+                campeonato=campeonato,
+            )
+        Jogo.objects.bulk_create(jogos.values(), batch_size=TAMANHO_LOTE_UPSERT, update_conflicts=True,
+                                 unique_fields=['id_externo'],
+                                 update_fields=['time_casa', 'time_fora', 'data', 'campeonato', 'updated_at'])
+        salvos = {jogo.id_externo: jogo for jogo in Jogo.objects.filter(id_externo__in=jogos.keys())}
+        Bolao.atualizar_primeiro_jogo(Bolao.objects.filter(jogos__in=[jogo.id for jogo in salvos.values()]))
+        return [salvos[str(jogo["fixture"]["id"])] for jogo, _ in fixtures]
 
     @classmethod
     def buscar_jogos(cls, campeonato: Campeonato):
@@ -109,31 +213,29 @@ class API:
             "from": str(today),
             "to": str(today + timedelta(days=int(os.getenv("DAYS_GET_JOGOS"))))
         }
-        response = requests.get(cls.url + 'fixtures', headers=cls.headers, params=parametros)
-        if response.status_code == 200:
-            return response.json()["response"]
+        status, jogos = cls.consultar('fixtures', parametros)
+        if status == 200:
+            return jogos
         if cls.api_using == 'RAPID_API':
-            raise Exception(f"Failed to retrieve fixtures. Status code: {response.status_code}")
+            raise Exception(f"Failed to retrieve fixtures. Status code: {status}")
         cls.set_rapid_api()
-        return cls.buscar_e_salvar_competicoes()
+        return cls.buscar_jogos(campeonato)
 
     @classmethod
     def buscar_e_salvar_jogos(cls, campeonatos: List[Campeonato]) -> bool:
-        criados = []
-        for campeonato in campeonatos:
-            jogos = cls.buscar_jogos(campeonato)
-            for jogo in jogos:
-                criados.append(cls.salvar_jogo(jogo, campeonato))
+        """
+        As buscas por campeonato rodam em paralelo em um pool limitado a `concorrencia` threads, que só fazem HTTP;
+        a gravação fica nesta thread, em um único lote (salvar_jogos) com as respostas de todos os campeonatos.
+        """
+        campeonatos = list(campeonatos)
+        fixtures = []
+        with ThreadPoolExecutor(max_workers=max(1, min(cls.concorrencia, len(campeonatos)))) as executor:
+            for campeonato, jogos in zip(campeonatos, executor.map(cls.buscar_jogos, campeonatos)):
+                fixtures.extend((jogo, campeonato) for jogo in jogos)
+        criados = cls.salvar_jogos(fixtures) if fixtures else []
+        invalidar_catalogo()
         return criados
 
-    @classmethod
-    def salvar_time(cls, id_externo: int, nome: str, logo: str):
-        time, _ = Time.objects.get_or_create(id_externo=str(id_externo), defaults={
-            "nome": nome,
-            "logo": logo
-        })
-        return time
-
     @staticmethod
     def obter_vencedor(placar_casa: int, placar_fora: int) -> str:
         if placar_casa is None and placar_fora is None:
@@ -155,7 +257,13 @@ class API:
         return placar_casa, placar_fora
 
     @classmethod
-    def salvar_resultdo(cls, data: dict, jogo: Jogo):
+    @transaction.atomic
+    def salvar_resultdo(cls, data: dict, jogo: Jogo) -> Jogo:
+        # A linha travada é a fonte do estado anterior: conferências simultâneas do mesmo jogo (uma por sincronização)
+        # ficam em fila e só a primeira vê o jogo ainda não finalizado.
+        jogo = Jogo.objects.select_for_update().get(pk=jogo.pk)
+        anterior = jogo.placar_contabilizado()
+        estava_finalizado = jogo.finalizado
         placar_casa = data["score"]["fulltime"]["home"]
         placar_fora = data["score"]["fulltime"]["away"]
         status = data["fixture"]["status"]["short"]
@@ -166,6 +274,23 @@ class API:
         jogo.placar_casa = placar_casa
         jogo.placar_fora = placar_fora
         jogo.save()
+        cls.processar_resultado(jogo, anterior, estava_finalizado)
+        return jogo
+
+    @staticmethod
+    def processar_resultado(jogo: Jogo, anterior: Optional[Tuple[int, int]], estava_finalizado: bool) -> None:
+        """
+        Efeitos de um resultado já salvo: acertos dos bilhetes, versão do catálogo e, quando o jogo acabou de
+        terminar, o desconto dos jogos pendentes e a finalização dos bolões que zeraram. Deve rodar na mesma
+        transação que travou o jogo para ler `anterior` e `estava_finalizado` (salvar_resultdo e JogoAdmin).
+        """
+        jogo.atualizar_acertos(anterior)
+        transaction.on_commit(invalidar_catalogo)
+        if jogo.finalizado and not estava_finalizado:
+            zerados = [str(bolao_id) for bolao_id in jogo.descontar_pendencias()]
+            if zerados:
+                transaction.on_commit(lambda: current_app.send_task('bolao.tasks.despachar_finalizacao',
+                                                                    args=(zerados, jogo.id_externo)))
 
     @classmethod
     def atualizar_resultados(cls, jogos: Union[QuerySet, Jogo], many: bool = True) -> bool:
@@ -174,9 +299,9 @@ class API:
             values = jogos.values('id_externo')
             for count in range(0, len(values), 20):
                 parametros['ids'] = '-'.join((jogo['id_externo'] for jogo in values[count:count+20:]))
-                response = requests.get(cls.url + 'fixtures', headers=cls.headers, params=parametros)
-                if response.status_code == 200:
-                    for data in response.json()["response"]:
+                status, resultados = cls.consultar('fixtures', parametros, ttl=cls.TTL_RESULTADOS, reserva=0)
+                if status == 200:
+                    for data in resultados:
                         cls.salvar_resultdo(data, jogos.get(id_externo=data["fixture"]["id"]))
                 else:
                     break
@@ -184,18 +309,18 @@ class API:
                 # Se o break não for chamado o for cai no else
                 return True
             if cls.api_using == 'RAPID_API':
-                raise Exception(f"Failed to retrieve fixtures. Status code: {response.status_code}")
+                raise Exception(f"Failed to retrieve fixtures. Status code: {status}")
             cls.set_rapid_api()
             return cls.atualizar_resultados(jogos, many)
         else:
             parametros['id'] = jogos.id_externo
-            response = requests.get(cls.url + 'fixtures', headers=cls.headers, params=parametros)
-            if response.status_code == 200:
-                data = response.json()["response"][0]
+            status, resultados = cls.consultar('fixtures', parametros, ttl=cls.TTL_RESULTADOS, reserva=0)
+            if status == 200:
+                data = resultados[0]
                 cls.salvar_resultdo(data, jogos)
                 return True
             else:
                 if cls.api_using == 'RAPID_API':
-                    raise Exception(f"Failed to retrieve fixtures. Status code: {response.status_code}")
+                    raise Exception(f"Failed to retrieve fixtures. Status code: {status}")
                 cls.set_rapid_api()
                 return cls.atualizar_resultados(jogos, many)
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.network.limitador import BaldeTokens
+
+STATUS_RETENTAVEIS = (429, 500, 502, 503, 504)
+
+
+class ClienteHTTP:
+    """
+    Sessão HTTP compartilhada por provedor.
+
+    Mantém um pool de conexões keep-alive por host, aplica timeouts explícitos de conexão e leitura e refaz as
+    requisições idempotentes com backoff exponencial em 429/5xx (respeitando o Retry-After). A latência de cada
+    chamada fica registrada por endpoint em `estatisticas()`. Com `limitador`, cada requisição consome antes um
+    token do balde do provedor, esperando no máximo `espera_maxima` segundos.
+    """
+
+    def __init__(self, nome: str, timeout=(3.05, 30), tentativas: int = 3, backoff: float = 0.5,
+                 conexoes: int = 10, limitador: Optional[BaldeTokens] = None, espera_maxima: float = 30):
+        self.nome = nome
+        self.timeout = timeout
+        self.limitador = limitador
+        self.espera_maxima = espera_maxima
+        retry = Retry(total=tentativas, backoff_factor=backoff, status_forcelist=STATUS_RETENTAVEIS,
+                      allowed_methods=frozenset(['GET', 'DELETE']), respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, max_retries=retry)
+        self.sessao = requests.Session()
+        self.sessao.mount('https://', adapter)
+        self.sessao.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._metricas = defaultdict(lambda: {'chamadas': 0, 'erros': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+
+    def request(self, metodo: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        if self.limitador:
+            self.limitador.adquirir(self.espera_maxima)
+        inicio = time.perf_counter()
+        erro = True
+        try:
+            response = self.sessao.request(metodo, url, **kwargs)
+            erro = response.status_code >= 400
+            return response
+        finally:
+            self.registrar(urlparse(url).path.rstrip('/').rsplit('/', 1)[-1],
+                           (time.perf_counter() - inicio) * 1000, erro)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def registrar(self, endpoint: str, duracao_ms: float, erro: bool) -> None:
+        with self._lock:
+            metrica = self._metricas[endpoint]
+            metrica['chamadas'] += 1
+            metrica['erros'] += int(erro)
+            metrica['total_ms'] += duracao_ms
+            metrica['max_ms'] = max(metrica['max_ms'], duracao_ms)
+
+    def estatisticas(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {endpoint: {**metrica, 'media_ms': metrica['total_ms'] / metrica['chamadas']}
+                    for endpoint, metrica in self._metricas.items()}
+
+    def estatisticas_limite(self) -> Dict:
+        """Esperas e recusas do balde de tokens deste processo."""
+        return self.limitador.estatisticas() if self.limitador else {}
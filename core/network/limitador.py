@@ -0,0 +1,133 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+import time
+from typing import Dict, Optional
+
+import redis
+
+from core.custom_exception import LimiteProvedorExcedido
+
+# Tokens por segundo e capacidade (rajada) padrão de cada provedor; sobrescritos por LIMITE_<NOME>_TAXA/_CAPACIDADE.
+LIMITES_PADRAO = {'football': (0.5, 5), 'asaas': (5.0, 10)}
+
+# Reabastece o balde pelo relógio do Redis e consome `custo` tokens se houver; senão devolve a espera em ms.
+SCRIPT_BALDE = """
+local taxa = tonumber(ARGV[1])
+local capacidade = tonumber(ARGV[2])
+local custo = tonumber(ARGV[3])
+local relogio = redis.call('TIME')
+local agora = tonumber(relogio[1]) * 1000 + math.floor(tonumber(relogio[2]) / 1000)
+local balde = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(balde[1]) or capacidade
+local ts = tonumber(balde[2]) or agora
+tokens = math.min(capacidade, tokens + math.max(0, agora - ts) * taxa / 1000)
+local espera = 0
+if tokens >= custo then
+    tokens = tokens - custo
+else
+    espera = math.ceil((custo - tokens) * 1000 / taxa)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', agora)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacidade * 1000 / taxa) + 1000)
+return espera
+"""
+
+
+class BaldeTokens(ABC):
+    """
+    Token bucket de um provedor externo.
+
+    `tentar` consome um token ou devolve quantos segundos faltam para o próximo; `adquirir` dorme até conseguir,
+    ou levanta LimiteProvedorExcedido quando a espera passa de `espera_maxima`, para o chamador adiar (Celery
+    refaz a task, a view responde 503). Esperas e bloqueios ficam em `estatisticas()`.
+    """
+
+    def __init__(self, nome: str, taxa: float, capacidade: int):
+        self.nome = nome
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._lock_metricas = threading.Lock()
+        self._metricas = {'liberados': 0, 'esperas': 0, 'recusados': 0, 'espera_total_ms': 0.0, 'espera_max_ms': 0.0}
+
+    @abstractmethod
+    def tentar(self, custo: int = 1) -> float:
+        """Consome `custo` tokens e retorna 0, ou retorna os segundos até haver tokens suficientes."""
+
+    def adquirir(self, espera_maxima: Optional[float] = None) -> float:
+        """Bloqueia até obter um token e retorna quantos segundos esperou."""
+        inicio, dormiu = time.monotonic(), False
+        while True:
+            espera = self.tentar()
+            decorrido = time.monotonic() - inicio if dormiu else 0
+            if espera <= 0:
+                self.registrar(decorrido)
+                return decorrido
+            if espera_maxima is not None and decorrido + espera > espera_maxima:
+                self.registrar(decorrido, recusado=True)
+                raise LimiteProvedorExcedido()
+            time.sleep(espera)
+            dormiu = True
+
+    def registrar(self, espera: float, recusado: bool = False) -> None:
+        with self._lock_metricas:
+            metrica = self._metricas
+            metrica['recusados' if recusado else 'liberados'] += 1
+            if espera > 0:
+                metrica['esperas'] += 1
+                metrica['espera_total_ms'] += espera * 1000
+                metrica['espera_max_ms'] = max(metrica['espera_max_ms'], espera * 1000)
+
+    def estatisticas(self) -> Dict:
+        with self._lock_metricas:
+            return {**self._metricas, 'taxa': self.taxa, 'capacidade': self.capacidade}
+
+
+class BaldeMemoria(BaldeTokens):
+    """Balde local ao processo, usado nos testes e quando não há Redis configurado."""
+
+    def __init__(self, nome: str, taxa: float, capacidade: int):
+        super().__init__(nome, taxa, capacidade)
+        self._lock = threading.Lock()
+        self._tokens = float(capacidade)
+        self._ts = time.monotonic()
+
+    def tentar(self, custo: int = 1) -> float:
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.capacidade, self._tokens + (agora - self._ts) * self.taxa)
+            self._ts = agora
+            if self._tokens >= custo:
+                self._tokens -= custo
+                return 0
+            return (custo - self._tokens) / self.taxa
+
+
+class BaldeRedis(BaldeTokens):
+    """Balde compartilhado por workers, beat e admin: o estado fica em uma hash no Redis atualizada via Lua."""
+
+    def __init__(self, nome: str, taxa: float, capacidade: int, url: str):
+        super().__init__(nome, taxa, capacidade)
+        self.chave = f'limitador:{nome}'
+        self.script = redis.Redis.from_url(url).register_script(SCRIPT_BALDE)
+
+    def tentar(self, custo: int = 1) -> float:
+        return int(self.script(keys=[self.chave], args=[self.taxa, self.capacidade, custo])) / 1000
+
+
+_baldes: Dict[str, BaldeTokens] = {}
+_lock_baldes = threading.Lock()
+
+
+def balde(nome: str) -> BaldeTokens:
+    """Balde do provedor `nome`, único por processo; no Redis de CACHE_URL quando configurado."""
+    with _lock_baldes:
+        if nome not in _baldes:
+            taxa, capacidade = LIMITES_PADRAO.get(nome, (1.0, 1))
+            taxa = float(os.getenv(f'LIMITE_{nome.upper()}_TAXA', taxa))
+            capacidade = int(os.getenv(f'LIMITE_{nome.upper()}_CAPACIDADE', capacidade))
+            if os.getenv('CACHE_URL'):
+                _baldes[nome] = BaldeRedis(nome, taxa, capacidade, os.getenv('CACHE_URL'))
+            else:
+                _baldes[nome] = BaldeMemoria(nome, taxa, capacidade)
+        return _baldes[nome]
@@ -0,0 +1,40 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CursorPaginacao(CursorPagination):
+    """
+    Paginação por cursor opaco em (created_at, id), sem OFFSET e sem COUNT(*).
+
+    O total só é calculado quando pedido com ?contar=true. Views com OrderingFilter devem declarar `ordering`
+    terminando em uma coluna única, que é usado no lugar do ordering padrão daqui. Um ?ordering= do cliente
+    recebe o id como desempate, senão colunas repetidas fazem as páginas pularem ou repetirem linhas.
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    contar_query_param = 'contar'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering += ('-id' if ordering[-1].startswith('-') else 'id', )
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.contar_query_param, '').lower() in ('true', '1'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+            response.data.move_to_end('count', last=False)
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'example': 123}
+        return response_schema
@@ -0,0 +1,210 @@
+import threading
+from unittest import mock
+
+from decimal import Decimal
+from django.core.cache import cache
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from bolao.models import Bolao, Campeonato, Jogo, Time
+from core.models import AsaasInformations, HistoricoTransacao
+from core.custom_exception import CotaInsuficiente, LimiteProvedorExcedido
+from core.network.football import API
+from core.network.http import ClienteHTTP
+from core.network.limitador import BaldeMemoria
+from usuario.factories.usuario import UsuarioFactory
+from usuario.models import Carteira
+
+
+def fixture(id_externo: int, casa: int, fora: int, data: str = '2030-01-01T16:00:00-03:00') -> dict:
+    return {
+        'fixture': {'id': id_externo, 'status': {'short': 'NS'}, 'date': data},
+        'teams': {'home': {'id': casa, 'name': f'Time {casa}', 'logo': f'https://localhost/{casa}.png'},
+                  'away': {'id': fora, 'name': f'Time {fora}', 'logo': f'https://localhost/{fora}.png'}},
+        'goals': {'home': None, 'away': None},
+    }
+
+
+class ClienteHTTPTest(SimpleTestCase):
+
+    def test_timeout_padrao_e_latencia_por_endpoint(self):
+        cliente = ClienteHTTP('teste', timeout=(1, 2))
+        with mock.patch.object(cliente.sessao, 'request', return_value=mock.Mock(status_code=200)) as request:
+            cliente.get('https://api.exemplo.com/v3/fixtures', params={'id': 1})
+            cliente.get('https://api.exemplo.com/v3/fixtures', params={'id': 2}, timeout=5)
+        self.assertEqual(request.call_args_list[0].kwargs['timeout'], (1, 2))
+        self.assertEqual(request.call_args_list[1].kwargs['timeout'], 5)
+        self.assertEqual(cliente.estatisticas()['fixtures']['chamadas'], 2)
+        self.assertEqual(cliente.estatisticas()['fixtures']['erros'], 0)
+
+    def test_sessao_com_retry_em_429_e_5xx(self):
+        retry = ClienteHTTP('teste').sessao.get_adapter('https://api.exemplo.com').max_retries
+        self.assertIn(429, retry.status_forcelist)
+        self.assertIn(503, retry.status_forcelist)
+        self.assertGreater(retry.backoff_factor, 0)
+
+
+class BaldeTokensTest(SimpleTestCase):
+
+    def test_rajada_espera_e_recusa(self):
+        balde = BaldeMemoria('teste', taxa=20, capacidade=2)
+        self.assertEqual(balde.adquirir(), 0)
+        self.assertEqual(balde.adquirir(), 0)
+        self.assertGreater(balde.tentar(), 0)
+        self.assertGreater(balde.adquirir(espera_maxima=1), 0)
+        with self.assertRaises(LimiteProvedorExcedido):
+            balde.adquirir(espera_maxima=0)
+        metricas = balde.estatisticas()
+        self.assertEqual((metricas['liberados'], metricas['esperas'], metricas['recusados']), (3, 1, 1))
+
+    def test_cliente_consome_token_antes_da_requisicao(self):
+        cliente = ClienteHTTP('teste', limitador=BaldeMemoria('teste', taxa=0.01, capacidade=1), espera_maxima=0)
+        with mock.patch.object(cliente.sessao, 'request', return_value=mock.Mock(status_code=200)) as request:
+            cliente.post('https://api.exemplo.com/v3/payments')
+            with self.assertRaises(LimiteProvedorExcedido):
+                cliente.post('https://api.exemplo.com/v3/payments')
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(cliente.estatisticas_limite()['recusados'], 1)
+
+
+class FootballAPITest(TestCase):
+
+    def setUp(self):
+        self.campeonatos = [Campeonato.objects.create(nome=f'Liga {i}', pais='Brasil', temporada_atual='2030',
+                                                      id_externo=str(i)) for i in range(4)]
+
+    def test_busca_concorrente_com_gravacao_unica(self):
+        barreira = threading.Barrier(len(self.campeonatos), timeout=5)
+
+        def buscar_jogos(campeonato):
+            barreira.wait()  # Só passa se as quatro buscas estiverem em andamento ao mesmo tempo.
+            indice = int(campeonato.id_externo)
+            return [fixture(100 + indice, indice, indice + 10)]
+
+        with mock.patch.object(API, 'concorrencia', 4), mock.patch.object(API, 'buscar_jogos', buscar_jogos), \
+                mock.patch('core.network.football.invalidar_catalogo'):
+            criados = API.buscar_e_salvar_jogos(Campeonato.objects.all())
+        self.assertEqual(len(criados), 4)
+        self.assertEqual(Jogo.objects.count(), 4)
+        self.assertEqual(Time.objects.count(), 8)
+
+    def test_troca_de_provedor_durante_a_busca_concorrente(self):
+        cache.clear()
+        chamadas = []
+
+        def get(url, headers, params):
+            chamadas.append((url, headers))
+            if 'rapidapi' not in url:
+                return mock.Mock(status_code=500, headers={})
+            return mock.Mock(status_code=200, headers={}, json=mock.Mock(return_value={'response': []}))
+
+        with mock.patch.object(API, 'api_using', 'IO'), mock.patch.object(API, 'url', API.url), \
+                mock.patch.object(API, 'headers', API.headers), mock.patch.object(API.cliente, 'get', get), \
+                mock.patch('core.network.football.invalidar_catalogo'):
+            self.assertEqual(API.buscar_e_salvar_jogos(Campeonato.objects.all()), [])
+            self.assertEqual(API.api_using, 'RAPID_API')
+        for url, headers in chamadas:
+            self.assertEqual('rapidapi' in url, 'x-rapidapi-key' in headers)
+
+    def test_upsert_em_lote_de_times_e_jogos(self):
+        campeonato = self.campeonatos[0]
+        with self.assertNumQueries(5) as poucos:
+            API.salvar_jogos([(fixture(1, 1, 2), campeonato)])
+        lote = [(fixture(i, i, i + 1, data='2030-02-01T16:00:00-03:00'), campeonato) for i in range(1, 11)]
+        lote[0][0]['teams']['home']['name'] = 'Renomeado'
+        with self.assertNumQueries(len(poucos)):
+            salvos = API.salvar_jogos(lote)
+        self.assertEqual([jogo.id_externo for jogo in salvos], [str(i) for i in range(1, 11)])
+        self.assertEqual(Jogo.objects.count(), 10)
+        self.assertEqual(Time.objects.count(), 11)
+        self.assertEqual(Time.objects.get(id_externo='1').nome, 'Renomeado')
+        self.assertEqual(Jogo.objects.get(id_externo='1').data.month, 2)
+
+    def test_sincronizacao_nao_sobrescreve_resultado(self):
+        jogo = API.salvar_jogos([(fixture(1, 1, 2), self.campeonatos[0])])[0]
+        bolao = Bolao.objects.create(criador=UsuarioFactory(), valor_palpite=10)
+        bolao.jogos.add(jogo)
+        bolao.atualizar_dados_jogos()
+
+        finalizado = fixture(1, 1, 2)
+        finalizado['fixture']['status']['short'] = 'FT'
+        finalizado['goals'] = {'home': 1, 'away': 0}
+        finalizado['score'] = {'fulltime': {'home': 1, 'away': 0}}
+        API.salvar_jogos([(finalizado, self.campeonatos[0])])
+        jogo.refresh_from_db()
+        self.assertEqual((jogo.status, jogo.placar_casa), ('NS', None))
+
+        with mock.patch('core.network.football.current_app.send_task') as send_task, \
+                mock.patch('core.network.football.invalidar_catalogo'), \
+                self.captureOnCommitCallbacks(execute=True):
+            API.salvar_resultdo(finalizado, jogo)
+        bolao.refresh_from_db()
+        self.assertEqual(bolao.jogos_pendentes, 0)
+        self.assertEqual(send_task.call_args.args[0], 'bolao.tasks.despachar_finalizacao')
+
+    def test_resultado_repetido_com_instancias_desatualizadas(self):
+        jogos = API.salvar_jogos([(fixture(i, i, i + 10), self.campeonatos[0]) for i in range(1, 4)])
+        bolao = Bolao.objects.create(criador=UsuarioFactory(), valor_palpite=10)
+        bolao.jogos.add(*jogos)
+        bolao.atualizar_dados_jogos()
+        finalizado = fixture(1, 1, 11)
+        finalizado['fixture']['status']['short'] = 'FT'
+        finalizado['score'] = {'fulltime': {'home': 1, 'away': 0}}
+
+        copias = [Jogo.objects.get(id=jogos[0].id), Jogo.objects.get(id=jogos[0].id)]
+        with mock.patch('core.network.football.invalidar_catalogo'):
+            for copia in copias:
+                API.salvar_resultdo(finalizado, copia)
+        bolao.refresh_from_db()
+        self.assertEqual(bolao.jogos_pendentes, 2)
+
+    def test_cache_de_respostas_e_cota(self):
+        cache.clear()
+        resposta = mock.Mock(status_code=200, headers={'x-ratelimit-requests-remaining': '50',
+                                                       'x-ratelimit-requests-limit': '100'})
+        resposta.json.return_value = {'response': [fixture(1, 1, 2)]}
+        with mock.patch.object(API.cliente, 'get', return_value=resposta) as get:
+            self.assertEqual(API.consultar('fixtures', {'league': '1', 'season': '2030'})[0], 200)
+            self.assertEqual(API.consultar('fixtures', {'season': '2030', 'league': '1'})[0], 200)
+            self.assertEqual(get.call_count, 1)
+            self.assertEqual(API.cota()['dia_restante'], 50)
+
+            resposta.headers = {'x-ratelimit-requests-remaining': str(API.reserva_cota)}
+            API.consultar('fixtures', {'league': '2'})
+            with self.assertRaises(CotaInsuficiente):
+                API.consultar('fixtures', {'league': '3'})
+            self.assertEqual(get.call_count, 2)
+            self.assertEqual(API.consultar('fixtures', {'id': '1'}, ttl=API.TTL_RESULTADOS, reserva=0)[0], 200)
+            self.assertEqual(get.call_count, 3)
+        self.assertLessEqual(API.espera_cota(), 24 * 60 * 60 + 1)
+
+        # Só a cota do minuto acabou: espera até o fim do minuto.
+        API.registrar_cota({'x-ratelimit-remaining': '0', 'x-ratelimit-requests-remaining': '50'})
+        self.assertLessEqual(API.espera_cota(), 61)
+        cache.clear()
+
+
+class WebhookTest(TestCase):
+
+    def test_transferencia_falha_carimba_saldo_da_linha(self):
+        carteira = UsuarioFactory().carteira
+        carteira.depositar(Decimal('100.00'))
+        infos = AsaasInformations.objects.create(asaas_id='tra_1', value=Decimal('80.00'), net_value=Decimal('80.00'))
+        saque = HistoricoTransacao.objects.create(carteira=carteira, valor=Decimal('80.00'), externo=True,
+                                                  tipo='SAQUE', status='PENDING', asaas_infos=infos)
+        Carteira.objects.filter(id=carteira.id).update(saldo=Decimal('20.00'))
+        depositar = Carteira.depositar
+
+        def depositar_com_compra_concorrente(self, *args, **kwargs):
+            # Uma compra debita a carteira entre a leitura do webhook e o crédito do estorno.
+            Carteira.objects.filter(id=self.id).update(saldo=F('saldo') - Decimal('10.00'))
+            return depositar(self, *args, **kwargs)
+
+        with mock.patch.object(Carteira, 'depositar', depositar_com_compra_concorrente):
+            response = APIClient().post('/api/v1/core/webhook/transfers/',
+                                        {'event': 'TRANSFER_FAILED', 'transfer': {'id': 'tra_1', 'value': 80}},
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+        saque.refresh_from_db()
+        self.assertEqual((saque.status, saque.saldo_apos), ('FAILED', Decimal('90.00')))
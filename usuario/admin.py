@@ -1,7 +1,8 @@
 from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 
-from .models import Carteira, PermissoesNotificacao, Endereco, Usuario, HistoricoTransacao, AsaasInformations
+from .models import (Carteira, PermissoesNotificacao, Endereco, Usuario, HistoricoTransacao, AsaasInformations,
+                     SubcarteiraBanca)
 
 admin.site.register(PermissoesNotificacao)
 admin.site.register(Endereco)
@@ -32,7 +33,7 @@ class UsuarioAdmin(UserAdmin):
 
     @admin.display(description="Saldo")
     def saldo(self, obj: Usuario):
-        return obj.saldo
+        return obj.carteira.saldo_total
 
     @admin.display(description="Bloqueado")
     def bloqueado(self, obj: Usuario):
@@ -42,7 +43,7 @@ class UsuarioAdmin(UserAdmin):
         if getattr(request.user, 'is_superuser', False):
             for usuario in queryset:
                 usuario.carteira.bloqueado = True
-                usuario.carteira.save()
+                usuario.carteira.save(update_fields=['bloqueado', 'updated_at'])
             messages.success(request, "Usuário(s) bloqueado(s) com sucesso.")
             return
         messages.error(request, "Você não tem permissão para realizar essa operação.")
@@ -58,8 +59,22 @@ class HistoricoTransacaoAdmin(admin.ModelAdmin):
 
 @admin.register(Carteira)
 class CarteiraAdmin(admin.ModelAdmin):
-    fields = ['saldo', 'bloqueado', 'asaas_customer']
-    list_display = ['saldo', 'bloqueado', 'asaas_customer']
+    fields = ['saldo', 'saldo_total', 'bloqueado', 'asaas_customer']
+    list_display = ['saldo_total', 'bloqueado', 'asaas_customer']
+    list_select_related = ['usuario']
+    # Na carteira da banca o saldo consolidado fica atrás das subcarteiras até a próxima consolidação.
+    readonly_fields = ['saldo_total']
+
+    @admin.display(description="Saldo total")
+    def saldo_total(self, obj: Carteira):
+        return obj.saldo_total
+
+
+@admin.register(SubcarteiraBanca)
+class SubcarteiraBancaAdmin(admin.ModelAdmin):
+    fields = ['indice', 'saldo']
+    list_display = ['indice', 'saldo', 'updated_at']
+    ordering = ['indice']
 
 
 @admin.register(AsaasInformations)
@@ -34,6 +34,7 @@ class CarteiraSerializer(serializers.ModelSerializer):
 
     valor = serializers.DecimalField(max_digits=9, decimal_places=2, required=False)
     conta = ContaExternaUsuarioSerializer(required=False)
+    saldo = serializers.DecimalField(source='saldo_total', max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = Carteira
@@ -183,3 +184,18 @@ class HistoricoTransacaoSerializer(serializers.ModelSerializer):
     class Meta:
         model = HistoricoTransacao
         fields = '__all__'
+
+
+class ExtratoSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = HistoricoTransacao
+        fields = ['id', 'tipo', 'valor', 'externo', 'saldo_apos', 'created_at']
+
+
+class ResumoExtratoSerializer(serializers.Serializer):
+
+    mes = serializers.DateTimeField(format='%Y-%m')
+    tipo = serializers.CharField()
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    quantidade = serializers.IntegerField()
@@ -1,3 +1,6 @@
+import csv
+import json
+from itertools import chain
 from rest_framework.viewsets import ViewSet, ReadOnlyModelViewSet
 from rest_framework.response import Response
 from rest_framework import status
@@ -6,18 +9,31 @@ from rest_framework.permissions import AllowAny
 from core import STATUS_HISTORICO
 from core.permissions import CARTEIRA_PERMISSIONS
 from rest_framework_simplejwt.tokens import RefreshToken
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Sum
+from django.db.models.functions import Abs, TruncMonth
 
 from core.custom_exception import (SaldoInvalidoException, UsuarioNaoEncontrado, DepositoInvalidoException,
                                    UnavailableService)
 from core.models import HistoricoTransacao
+from core.pagination import CursorPaginacao
 from usuario.api.serializers import (CriarUsuarioSerializer, UsuarioNotificacaoSerializer, UsuarioNovaSenhaSerializer,
                                      UsuarioSerializer, CarteiraSerializer, HistoricoTransacaoSerializer,
-                                     AsaasInfosSerializer)
+                                     AsaasInfosSerializer, ExtratoSerializer, ResumoExtratoSerializer)
 
 from usuario.models import Carteira, CodigosDeValidacao, Usuario
 
 
+class Echo:
+    """Buffer de escrita para o csv.writer que só devolve a linha, usado nas respostas em streaming."""
+
+    def write(self, value):
+        return value
+
+
 class CriarUsuarioViewSet(ViewSet):
 
     queryset = Usuario.objects.all()
@@ -167,7 +183,59 @@ class CarteiraViewSet(ViewSet):
 class HistoricoTransfereciaViewSet(ReadOnlyModelViewSet):
     queryset = HistoricoTransacao.objects.filter(status=STATUS_HISTORICO['CONFIRMED'])
     serializer_class = HistoricoTransacaoSerializer
+    pagination_class = CursorPaginacao
+    ordering = ('-created_at', '-id')
+    ordering_fields = ['created_at']
+    resumo_timeout = 60 * 60 * 24
+    exportar_chunk_size = 2000
 
     def get_queryset(self):
-        queryset = self.queryset.filter(carteira=self.request.user.carteira).order_by('-created_at')
+        queryset = self.queryset.filter(carteira=self.request.user.carteira)
+        if self.action == 'list':
+            queryset = queryset.only(*ExtratoSerializer.Meta.fields)
         return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ExtratoSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=['GET'])
+    def resumo(self, request):
+        """
+        Totais por mês e tipo em um único GROUP BY. A chave do cache leva o updated_at da carteira, que muda a cada
+        movimentação, então o resumo vale até a próxima transação.
+        """
+        carteira = request.user.carteira
+        chave = f'resumo:{carteira.id}:{carteira.updated_at.isoformat()}'
+        resumo = cache.get(chave)
+        if resumo is None:
+            linhas = self.queryset.filter(carteira=carteira).annotate(mes=TruncMonth('created_at')).order_by(
+                '-mes', 'tipo').values('mes', 'tipo').annotate(
+                total=Sum(Abs('valor')), quantidade=Count('id'))
+            resumo = ResumoExtratoSerializer(linhas, many=True).data
+            cache.set(chave, resumo, self.resumo_timeout)
+        return Response(resumo, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['GET'])
+    def exportar(self, request):
+        """
+        Extrato completo em CSV (padrão) ou NDJSON (?formato=ndjson). As linhas vêm de um cursor do banco em blocos
+        e são escritas conforme são lidas, então a memória não cresce com o tamanho do histórico.
+        """
+        formato = request.query_params.get('formato', 'csv')
+        if formato not in ('csv', 'ndjson'):
+            return Response({'message': 'Formato inválido, use csv ou ndjson.'}, status=status.HTTP_400_BAD_REQUEST)
+        campos = ExtratoSerializer.Meta.fields
+        linhas = self.get_queryset().order_by('created_at', 'id').values_list(*campos).iterator(
+            chunk_size=self.exportar_chunk_size)
+
+        if formato == 'ndjson':
+            conteudo = (json.dumps(dict(zip(campos, linha)), cls=DjangoJSONEncoder) + '\n' for linha in linhas)
+            response = StreamingHttpResponse(conteudo, content_type='application/x-ndjson')
+        else:
+            escritor = csv.writer(Echo())
+            conteudo = chain([escritor.writerow(campos)], (escritor.writerow(linha) for linha in linhas))
+            response = StreamingHttpResponse(conteudo, content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="extrato.{formato}"'
+        return response
@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.custom_exception import SaldoInvalidoException
+from core.models import HistoricoTransacao
+from usuario.models import Carteira
+
+
+class Command(BaseCommand):
+    help = 'Dispara compras simultâneas contra uma única carteira e confere se o saldo final bate com os débitos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--compras', type=int, default=200, help='Compras por thread.')
+        parser.add_argument('--valor', type=Decimal, default=Decimal('1.00'))
+        parser.add_argument('--saldo', type=Decimal, help='Saldo inicial. Padrão: metade do total das compras, '
+                                                          'para que parte delas seja recusada.')
+
+    def handle(self, *args, **options):
+        total = options['threads'] * options['compras']
+        saldo_inicial = options['saldo'] if options['saldo'] is not None else options['valor'] * total / 2
+        carteira = Carteira.objects.create(saldo=saldo_inicial)
+
+        def comprar(_):
+            aprovadas = 0
+            try:
+                for _ in range(options['compras']):
+                    try:
+                        Carteira.objects.get(id=carteira.id).saque(options['valor'])
+                        aprovadas += 1
+                    except SaldoInvalidoException:
+                        pass
+            finally:
+                connection.close()
+            return aprovadas
+
+        try:
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                aprovadas = sum(executor.map(comprar, range(options['threads'])))
+            duracao = time.perf_counter() - inicio
+
+            carteira.refresh_from_db()
+            esperado = saldo_inicial - options['valor'] * aprovadas
+            lancamentos = HistoricoTransacao.objects.filter(carteira=carteira).count()
+            self.stdout.write(f'{total} compras em {duracao:.2f}s ({total / duracao:.0f}/s), {aprovadas} aprovadas')
+            self.stdout.write(f'Saldo final {carteira.saldo}, esperado {esperado}, {lancamentos} lançamentos')
+            if carteira.saldo != esperado or carteira.saldo < 0 or lancamentos != aprovadas:
+                self.stdout.write(self.style.ERROR('Saldo inconsistente com os débitos aprovados.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Saldo consistente.'))
+        finally:
+            HistoricoTransacao.objects.filter(carteira=carteira).delete()
+            carteira.delete()
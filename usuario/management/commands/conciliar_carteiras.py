@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.management.base import BaseCommand
+from django.db.models import Case, F, Func, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+
+from core.models import HistoricoTransacao
+from usuario.models import Carteira, SubcarteiraBanca
+
+
+class Command(BaseCommand):
+    help = 'Confere o saldo de cada carteira contra o histórico de transações com uma única consulta agregada.'
+
+    def handle(self, *args, **options):
+        historico = HistoricoTransacao.objects.filter(carteira=OuterRef('pk')).order_by().values('carteira').annotate(
+            total=Sum(HistoricoTransacao.efeito_no_saldo())).values('total')
+        saldo = F('saldo')
+        try:
+            subcarteiras = SubcarteiraBanca.objects.order_by().values(total=Func('saldo', function='SUM'))
+            saldo = Case(When(id=Carteira.id_banca(), then=F('saldo') + Coalesce(Subquery(subcarteiras), Decimal(0))),
+                         default=F('saldo'))
+        except (ImproperlyConfigured, ObjectDoesNotExist):
+            pass
+
+        divergentes = Carteira.objects.annotate(saldo_total=saldo,
+                                                saldo_historico=Coalesce(Subquery(historico), Decimal(0))).exclude(
+            saldo_total=F('saldo_historico')).values_list('id', 'saldo_total', 'saldo_historico')
+
+        total = 0
+        for carteira_id, saldo_carteira, saldo_historico in divergentes.iterator():
+            total += 1
+            self.stdout.write(f'{carteira_id}: saldo {saldo_carteira}, histórico {saldo_historico} '
+                              f'(diferença {saldo_carteira - saldo_historico})')
+        if total:
+            self.stdout.write(self.style.ERROR(f'{total} carteiras divergentes.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Todas as carteiras conferem com o histórico.'))
@@ -0,0 +1,29 @@
+# Generated by Django 4.0 on 2026-10-18 09:35
+
+from decimal import Decimal
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuario', '0017_remove_carteira_pix_contaexternausuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubcarteiraBanca',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+                ('indice', models.PositiveSmallIntegerField(unique=True, verbose_name='Índice')),
+                ('saldo', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12, verbose_name='Saldo')),
+            ],
+            options={
+                'verbose_name': 'Subcarteira da banca',
+                'verbose_name_plural': 'Subcarteiras da banca',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0 on 2026-10-18 09:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuario', '0018_subcarteirabanca'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoDiario',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Saldo no fechamento')),
+                ('carteira', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_diarios', to='usuario.carteira', verbose_name='Carteira')),
+            ],
+            options={
+                'verbose_name': 'Saldo diário',
+                'verbose_name_plural': 'Saldos diários',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='saldodiario',
+            constraint=models.UniqueConstraint(fields=('carteira', 'data'), name='saldo_diario_carteira_data_unico'),
+        ),
+    ]
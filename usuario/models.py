@@ -1,12 +1,19 @@
 import os
+import random
+from collections import Counter, defaultdict
 from decimal import Decimal
+from typing import Iterable, Optional
 from uuid import uuid4
-from datetime import date
+from datetime import date, datetime, time
 from datetime import timedelta
+from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
+from django.core.exceptions import ImproperlyConfigured
 
 from django.db import models, transaction
+from django.db.models import Case, Exists, F, Func, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from core import TIPO_CONTA, STATUS_HISTORICO
 
@@ -121,29 +128,143 @@ class Carteira(BaseModel):
         return valor >= 0
 
     @transaction.atomic
-    def saque(self, valor: Decimal, externo: bool = False, salvar_historico: bool = True) -> None:
-        if not self.saque_valido(valor, externo=externo) and salvar_historico:
+    def saque(self, valor: Decimal, externo: bool = False, salvar_historico: bool = True,
+              forcar: Optional[bool] = None) -> None:
+        """
+        Débito atômico: a verificação de saldo vai no próprio UPDATE (saldo >= valor), então compras simultâneas na
+        mesma carteira nunca perdem atualização nem deixam o saldo negativo. Sem histórico o débito é forçado, a menos
+        que forcar=False.
+        """
+        forcar = not salvar_historico if forcar is None else forcar
+        carteiras = Carteira.objects.filter(id=self.id)
+        if not forcar:
+            if externo and valor < Decimal(os.getenv('MIN_SAQUE')):
+                raise SaldoInvalidoException()
+            carteiras = carteiras.filter(saldo__gte=valor, bloqueado=False)
+        agora = timezone.now()
+        if not carteiras.update(saldo=F('saldo') - valor, updated_at=agora):
             raise SaldoInvalidoException()
-        self.saldo -= valor
-        self.save()
+        self.saldo, self.updated_at = self.saldo - valor, agora
         if salvar_historico:
-            HistoricoTransacao.objects.create(carteira=self, valor=valor, externo=externo,
-                                              tipo=HistoricoTransacao.get_type(valor=-valor, externo=externo))
+            self.registrar_historico(valor, -valor, externo)
 
     @transaction.atomic
     def depositar(self, valor: Decimal, externo: bool = False, is_webhook: bool = False) -> None:
-        if not self.deposito_valido(valor, externo=externo) and not is_webhook:
+        carteiras = Carteira.objects.filter(id=self.id)
+        if not is_webhook:
+            if not self.deposito_valido(valor, externo=externo):
+                raise DepositoInvalidoException()
+            carteiras = carteiras.filter(bloqueado=False)
+        agora = timezone.now()
+        if not carteiras.update(saldo=F('saldo') + valor, updated_at=agora):
             raise DepositoInvalidoException()
-        self.saldo += valor
-        self.save()
+        self.saldo, self.updated_at = self.saldo + valor, agora
         if not is_webhook:
-            HistoricoTransacao.objects.create(carteira=self, valor=valor, externo=externo,
-                                              tipo=HistoricoTransacao.get_type(valor=valor, externo=externo))
+            self.registrar_historico(valor, valor, externo)
+
+    def registrar_historico(self, valor: Decimal, efeito: Decimal, externo: bool, **campos) -> HistoricoTransacao:
+        """
+        Lançamento de uma movimentação já aplicada. O saldo_apos é lido do banco pelo próprio INSERT (subconsulta na
+        carteira), então o valor é o da linha atualizada mesmo que a instância em memória esteja desatualizada.
+        """
+        return HistoricoTransacao.objects.create(
+            carteira=self, valor=valor, externo=externo,
+            tipo=HistoricoTransacao.get_type(valor=efeito, externo=externo),
+            saldo_apos=Subquery(Carteira.objects.filter(id=self.id).values('saldo')[:1]), **campos)
+
+    @classmethod
+    @transaction.atomic
+    def depositar_em_lote(cls, valor: Decimal, carteiras: Iterable) -> int:
+        """
+        Credita `valor` uma vez para cada ocorrência de carteira em `carteiras`.
+
+        As carteiras são agrupadas pela quantidade de ocorrências, então o crédito é feito com um UPDATE
+        baseado em F() por multiplicidade (normalmente um só) e o histórico com um único bulk_create.
+
+        :return: Quantidade de carteiras creditadas.
+        """
+        if valor < 0:
+            raise DepositoInvalidoException()
+        ocorrencias = Counter(carteiras)
+        if cls.objects.filter(id__in=ocorrencias.keys(), bloqueado=True).exists():
+            raise DepositoInvalidoException()
+        por_multiplicidade = defaultdict(list)
+        for carteira_id, vezes in ocorrencias.items():
+            por_multiplicidade[vezes].append(carteira_id)
+        now = timezone.now()
+        for vezes, ids in por_multiplicidade.items():
+            cls.objects.filter(id__in=ids).update(saldo=F('saldo') + valor * vezes, updated_at=now)
+        saldos = dict(cls.objects.filter(id__in=ocorrencias.keys()).values_list('id', 'saldo'))
+        HistoricoTransacao.registrar_em_lote({carteira_id: valor * vezes
+                                              for carteira_id, vezes in ocorrencias.items()}, saldos=saldos)
+        return len(ocorrencias)
+
+    @classmethod
+    def id_banca(cls):
+        """ID_CARTEIRA_BANCA aceita tanto o id da carteira da banca quanto o do usuário dono dela."""
+        identificador = os.getenv('ID_CARTEIRA_BANCA')
+        if not identificador:
+            raise ImproperlyConfigured('ID_CARTEIRA_BANCA não configurado.')
+        return cls.objects.filter(Q(id=identificador) | Q(usuario__id=identificador)).values_list(
+            'id', flat=True).get()
+
+    @classmethod
+    @transaction.atomic
+    def movimentar_banca(cls, valor: Decimal, externo: bool = False, salvar_historico: bool = True):
+        """
+        Credita (ou debita, se negativo) a banca através de uma subcarteira sorteada, sem travar a linha da carteira
+        da banca. O lançamento fica na carteira da banca. Retorna o id dela.
+        """
+        carteira_id = cls.id_banca()
+        SubcarteiraBanca.movimentar(valor)
+        if salvar_historico:
+            HistoricoTransacao.objects.create(carteira_id=carteira_id, valor=valor, externo=externo,
+                                              tipo=HistoricoTransacao.get_type(valor=valor, externo=externo),
+                                              saldo_apos=cls.saldo_banca_subconsulta(carteira_id))
+        return carteira_id
+
+    @classmethod
+    def saldo_banca_subconsulta(cls, carteira_id) -> Subquery:
+        """
+        Saldo consolidado da banca mais o das subcarteiras, como subconsulta. É o saldo_apos dos lançamentos da banca:
+        SubcarteiraBanca.consolidar só move valores entre as duas partes e não altera o total.
+        """
+        subcarteiras = SubcarteiraBanca.objects.order_by().values(total=Func('saldo', function='SUM'))
+        return Subquery(cls.objects.filter(id=carteira_id).annotate(
+            total=F('saldo') + Coalesce(Subquery(subcarteiras), Decimal(0))).values('total')[:1])
+
+    @classmethod
+    def saldo_banca(cls) -> Decimal:
+        """Saldo consolidado da banca mais o das subcarteiras, lidos na mesma consulta."""
+        subcarteiras = SubcarteiraBanca.objects.order_by().values(total=Func('saldo', function='SUM'))
+        return cls.objects.filter(id=cls.id_banca()).annotate(
+            total=F('saldo') + Coalesce(Subquery(subcarteiras), Decimal(0))).values_list('total', flat=True).get()
 
     @property
     def saldo(self):
         return self.saldo
 
+    @property
+    def da_banca(self) -> bool:
+        """Compara com ID_CARTEIRA_BANCA sem consulta (o usuário já vem carregado junto da carteira)."""
+        identificador = os.getenv('ID_CARTEIRA_BANCA')
+        usuario = getattr(self, 'usuario', None)
+        return bool(identificador) and identificador in (str(self.id), str(usuario.id) if usuario else None)
+
+    @property
+    def saldo_total(self) -> Decimal:
+        """Saldo a exibir: na carteira da banca inclui as subcarteiras ainda não consolidadas (saldo_banca)."""
+        return Carteira.saldo_banca() if self.da_banca else self.saldo
+
+    def saldo_em(self, momento) -> Decimal:
+        """Saldo em um instante: saldo_apos do último lançamento efetivado até lá ou, sem lançamentos, a foto diária."""
+        saldo = self.historico_transacao.filter(efetivado_em__lte=momento, saldo_apos__isnull=False).order_by(
+            '-efetivado_em').values_list('saldo_apos', flat=True).first()
+        if saldo is None:
+            saldo = self.saldos_diarios.filter(data__lte=momento.date()).order_by('-data').values_list(
+                'saldo', flat=True).first()
+        return Decimal(0) if saldo is None else saldo
+
     def solicitar_cash_in(self, valor: Decimal) -> HistoricoTransacao:
         if self.deposito_valido(valor, externo=True):
             uuid = uuid4()
@@ -157,7 +278,7 @@ class Carteira(BaseModel):
                                                                invoice_url=response['invoiceUrl'],
                                                                billet_url=response['bankSlipUrl'])
                 transaction = HistoricoTransacao.objects.create(id=uuid, carteira=self, valor=valor,
-                                                                externo=True, status='PENDING',
+                                                                externo=True, status='PENDING', efetivado_em=None,
                                                                 tipo=HistoricoTransacao.get_type(valor=valor,
                                                                                                  externo=True),
                                                                 asaas_infos=asaas_infos)
@@ -166,23 +287,28 @@ class Carteira(BaseModel):
         raise DepositoInvalidoException()
 
     def solicitar_cash_out(self, valor: Decimal, conta: dict) -> bool:
-        if self.saque_valido(valor, externo=True):
+        """
+        Reserva o valor com o débito condicional (saldo >= valor) antes de enviar o PIX, então dois saques simultâneos
+        não conseguem os dois passar do saldo. Se a Asaas recusar ou falhar, a reserva é devolvida.
+        """
+        self.saque(valor=valor, externo=True, salvar_historico=False, forcar=False)
+        try:
             status, response = Transferencia.enviar_pix(valor=valor, banco_code=conta['code_banco'],
                                                         agencia=conta['agencia'], numero_conta=conta['num_conta'],
                                                         digito_conta=conta['digito'], tipo_conta=conta['tipo_conta'],
                                                         usuario=self.usuario)
-            if status:
-                self.saque(valor=valor, externo=True, salvar_historico=False)
-                obj_conta, _ = ContaExternaUsuario.objects.get_or_create(**conta, defaults={'carteira': self})
-                asaas_infos = AsaasInformations.objects.create(asaas_id=response['id'], op_type=response['object'],
-                                                               value=response['value'], net_value=response['netValue'])
-                HistoricoTransacao.objects.create(carteira=self, valor=-valor, externo=True, conta=obj_conta,
-                                                  tipo=HistoricoTransacao.get_type(valor=-valor, externo=True),
-                                                  status=STATUS_HISTORICO['PENDING'],
-                                                  asaas_infos=asaas_infos)
-                return True
-            return UnavailableService()
-        raise SaldoInvalidoException()
+        except Exception:
+            self.depositar(valor, externo=True, is_webhook=True)
+            raise
+        if not status:
+            self.depositar(valor, externo=True, is_webhook=True)
+            raise UnavailableService()
+        obj_conta, _ = ContaExternaUsuario.objects.get_or_create(**conta, defaults={'carteira': self})
+        asaas_infos = AsaasInformations.objects.create(asaas_id=response['id'], op_type=response['object'],
+                                                       value=response['value'], net_value=response['netValue'])
+        self.registrar_historico(-valor, -valor, True, conta=obj_conta, status=STATUS_HISTORICO['PENDING'],
+                                 asaas_infos=asaas_infos)
+        return True
 
     def __str__(self):
         try:
@@ -191,6 +317,103 @@ class Carteira(BaseModel):
             return f'Saldo: {self.saldo}'
 
 
+class SubcarteiraBanca(BaseModel):
+    """
+    Fração do saldo da carteira da banca.
+
+    Liquidações de bolões e taxas dos webhooks caem em uma subcarteira sorteada, então não disputam o lock de uma
+    única linha. A tarefa consolidar_carteira_banca transfere periodicamente os saldos para a carteira da banca.
+    """
+
+    indice = models.PositiveSmallIntegerField('Índice', unique=True)
+    saldo = models.DecimalField('Saldo', max_digits=12, decimal_places=2, default=Decimal(0))
+
+    class Meta:
+        verbose_name = 'Subcarteira da banca'
+        verbose_name_plural = 'Subcarteiras da banca'
+
+    @staticmethod
+    def quantidade() -> int:
+        return int(os.getenv('SUBCARTEIRAS_BANCA', 16))
+
+    @classmethod
+    def movimentar(cls, valor: Decimal) -> None:
+        indice = random.randrange(cls.quantidade())
+        subcarteiras = cls.objects.filter(indice=indice)
+        if not subcarteiras.update(saldo=F('saldo') + valor, updated_at=timezone.now()):
+            _, criada = cls.objects.get_or_create(indice=indice, defaults={'saldo': valor})
+            if not criada:
+                subcarteiras.update(saldo=F('saldo') + valor, updated_at=timezone.now())
+
+    @classmethod
+    @transaction.atomic
+    def consolidar(cls) -> Decimal:
+        """
+        Move o saldo das subcarteiras para a carteira da banca. Retorna o valor consolidado.
+
+        O total da banca não muda, então não há lançamento: o saldo_apos da banca já é o total (saldo_banca).
+        """
+        carteira_id = Carteira.id_banca()
+        saldos = dict(cls.objects.select_for_update().exclude(saldo=0).values_list('id', 'saldo'))
+        total = sum(saldos.values(), Decimal(0))
+        if saldos:
+            now = timezone.now()
+            cls.objects.filter(id__in=saldos.keys()).update(saldo=Decimal(0), updated_at=now)
+            Carteira.objects.filter(id=carteira_id).update(saldo=F('saldo') + total, updated_at=now)
+        return total
+
+    def __str__(self) -> str:
+        return f'Subcarteira {self.indice}|Saldo: {self.saldo}'
+
+
+class SaldoDiario(BaseModel):
+
+    carteira = models.ForeignKey(Carteira, verbose_name='Carteira', on_delete=models.CASCADE,
+                                 related_name='saldos_diarios')
+    data = models.DateField('Data')
+    saldo = models.DecimalField('Saldo no fechamento', max_digits=12, decimal_places=2)
+
+    class Meta:
+        verbose_name = 'Saldo diário'
+        verbose_name_plural = 'Saldos diários'
+        constraints = [models.UniqueConstraint(fields=['carteira', 'data'], name='saldo_diario_carteira_data_unico')]
+
+    @classmethod
+    def registrar(cls, data: date = None) -> int:
+        """
+        Registra o fechamento do dia `data` (padrão: ontem, no fuso do projeto) das carteiras movimentadas desde
+        então. Roda logo após a virada do dia.
+
+        O fechamento é o saldo_apos do último lançamento efetivado até o fim do dia. O saldo atual só é usado quando
+        não há lançamento depois disso, então uma execução atrasada ou retroativa não leva o dia seguinte junto.
+        """
+        # Com USE_TZ=False o Django ajusta o fuso do processo para TIME_ZONE e as datas do banco são locais.
+        hoje = timezone.localdate() if settings.USE_TZ else date.today()
+        data = data or hoje - timedelta(days=1)
+        inicio, fim = (datetime.combine(dia, time.min) for dia in (data, data + timedelta(days=1)))
+        if settings.USE_TZ:
+            inicio, fim = timezone.make_aware(inicio), timezone.make_aware(fim)
+        historico = HistoricoTransacao.objects.filter(carteira=OuterRef('pk'))
+        fechamento = historico.filter(efetivado_em__lt=fim, saldo_apos__isnull=False).order_by(
+            '-efetivado_em').values('saldo_apos')[:1]
+        saldo_atual = F('saldo')
+        try:
+            carteira_banca = Carteira.id_banca()
+            saldo_atual = Case(When(id=carteira_banca, then=Carteira.saldo_banca_subconsulta(carteira_banca)),
+                               default=F('saldo'))
+        except (ImproperlyConfigured, Carteira.DoesNotExist):
+            pass
+        carteiras = Carteira.objects.filter(updated_at__gte=inicio).annotate(fechamento=Case(
+            When(Exists(historico.filter(efetivado_em__gte=fim)), then=Subquery(fechamento)), default=saldo_atual)
+        ).exclude(fechamento=None).values_list('id', 'fechamento')
+        return len(cls.objects.bulk_create([cls(carteira_id=carteira_id, data=data, saldo=saldo)
+                                            for carteira_id, saldo in carteiras.iterator()],
+                                           batch_size=1000, ignore_conflicts=True))
+
+    def __str__(self) -> str:
+        return f'{self.data}|Saldo: {self.saldo}'
+
+
 class Usuario(AbstractBaseUser, PermissionsMixin):
 
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
@@ -244,11 +467,14 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     def save(self, **kwargs):
         if self._state.adding:
             self.carteira = Carteira.objects.create()
-            status, customer = Customer.create_customer(self.nome, clean_cpf(self.cpf),
-                                                        str(self.carteira.id))
+            try:
+                status, customer = Customer.create_customer(self.nome, clean_cpf(self.cpf),
+                                                            str(self.carteira.id))
+            except UnavailableService:
+                status = False
             if status:
                 self.carteira.asaas_customer = customer["id"]
-                self.carteira.save()
+                self.carteira.save(update_fields=['asaas_customer', 'updated_at'])
             self.set_password(self.password)
         return super().save(**kwargs)
 
@@ -0,0 +1,13 @@
+from celery import shared_task
+
+from .models import SaldoDiario, SubcarteiraBanca
+
+
+@shared_task
+def consolidar_carteira_banca():
+    return str(SubcarteiraBanca.consolidar())
+
+
+@shared_task
+def registrar_saldos_diarios():
+    return SaldoDiario.registrar()
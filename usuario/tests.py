@@ -1,10 +1,27 @@
+import json
+import os
+from importlib import import_module
+from datetime import date, timedelta
 import uuid
 from decimal import Decimal
+from io import StringIO
+from django.apps import apps
+from django.contrib.admin import site
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
 from django.test import TestCase
-from unittest import skip
+from django.utils import timezone
+from rest_framework.test import APIClient
+from unittest import mock, skip
 from django.db.utils import IntegrityError
-from .models import PermissoesNotificacao, Endereco, Carteira, Usuario
-from core.custom_exception import SaldoInvalidoException, DepositoInvalidoException
+from .admin import CarteiraAdmin
+from .models import PermissoesNotificacao, Endereco, Carteira, SaldoDiario, SubcarteiraBanca, Usuario
+from core.custom_exception import (SaldoInvalidoException, DepositoInvalidoException, LimiteProvedorExcedido,
+                                   UnavailableService)
+from core.network import asaas
+from core.models import HistoricoTransacao
+from .factories.usuario import PermissoesNotificacaoFactory, UsuarioFactory
 
 
 class PermissoesNotificacaoModelTest(TestCase):
@@ -51,6 +68,38 @@ class CarteiraModelTest(TestCase):
         with self.assertRaises(SaldoInvalidoException):
             self.carteira.saque(Decimal("100"))
 
+    def test_saque_com_instancia_desatualizada(self):
+        self.carteira.depositar(Decimal("10"))
+        outra = Carteira.objects.get(id=self.carteira.id)
+        self.carteira.saque(Decimal("10"))
+        with self.assertRaises(SaldoInvalidoException):
+            outra.saque(Decimal("10"))
+        outra.depositar(Decimal("5"))
+        self.carteira.refresh_from_db()
+        self.assertEqual(self.carteira.saldo, Decimal("5"))
+
+    def test_cash_out_reserva_o_saldo_antes_do_pix(self):
+        carteira = UsuarioFactory().carteira
+        carteira.depositar(Decimal("100"))
+        outra = Carteira.objects.get(id=carteira.id)
+        conta = {'code_banco': '001', 'agencia': '1234', 'tipo_conta': 'CONTA_CORRENTE', 'num_conta': '12345',
+                 'digito': '1'}
+        pix = {'id': 'tra_1', 'object': 'transfer', 'value': 80, 'netValue': 80}
+        with mock.patch('usuario.models.Transferencia.enviar_pix', return_value=(True, pix)) as enviar_pix:
+            self.assertTrue(carteira.solicitar_cash_out(Decimal("80"), conta))
+            with self.assertRaises(SaldoInvalidoException):
+                outra.solicitar_cash_out(Decimal("80"), conta)
+        self.assertEqual(enviar_pix.call_count, 1)
+        carteira.refresh_from_db()
+        self.assertEqual(carteira.saldo, Decimal("20"))
+        self.assertEqual(carteira.historico_transacao.get(status='PENDING').saldo_apos, Decimal("20"))
+
+        with mock.patch('usuario.models.Transferencia.enviar_pix', return_value=(False, {})):
+            with self.assertRaises(UnavailableService):
+                carteira.solicitar_cash_out(Decimal("15"), conta)
+        carteira.refresh_from_db()
+        self.assertEqual(carteira.saldo, Decimal("20"))
+
     def test_depositar(self):
         self.carteira.depositar(Decimal("100"))
         self.assertEqual(self.carteira.saldo, Decimal("100"))
@@ -59,6 +108,78 @@ class CarteiraModelTest(TestCase):
         with self.assertRaises(DepositoInvalidoException):
             self.carteira.depositar(Decimal("0.50"), externo=True)
 
+    def test_depositar_em_lote(self):
+        creditadas = Carteira.depositar_em_lote(Decimal('10.00'), [self.carteira.id, self.carteira2.id,
+                                                                   self.carteira2.id])
+        self.carteira.refresh_from_db()
+        self.carteira2.refresh_from_db()
+        self.assertEqual(creditadas, 2)
+        self.assertEqual(self.carteira.saldo, Decimal('10.00'))
+        self.assertEqual(self.carteira2.saldo, Decimal('20.00'))
+        self.assertEqual(self.carteira2.historico_transacao.get().valor, Decimal('20.00'))
+
+    def test_depositar_em_lote_carteira_bloqueada(self):
+        self.carteira2.bloqueado = True
+        self.carteira2.save()
+        with self.assertRaises(DepositoInvalidoException):
+            Carteira.depositar_em_lote(Decimal('10.00'), [self.carteira.id, self.carteira2.id])
+        self.carteira.refresh_from_db()
+        self.assertEqual(self.carteira.saldo, Decimal('0'))
+
+    def test_subcarteiras_da_banca(self):
+        with mock.patch.dict(os.environ, {'ID_CARTEIRA_BANCA': str(self.carteira.id), 'SUBCARTEIRAS_BANCA': '4'}):
+            for _ in range(10):
+                Carteira.movimentar_banca(Decimal('2.50'))
+            Carteira.movimentar_banca(Decimal('-5.00'), externo=True)
+            self.assertEqual(Carteira.saldo_banca(), Decimal('20.00'))
+            self.assertLessEqual(SubcarteiraBanca.objects.count(), 4)
+            self.assertEqual(self.carteira.historico_transacao.count(), 11)
+            saldos = self.carteira.historico_transacao.order_by('efetivado_em').values_list('saldo_apos', flat=True)
+            self.assertEqual((saldos.first(), saldos.last()), (Decimal('2.50'), Decimal('20.00')))
+            self.assertEqual(self.carteira.saldo_em(timezone.now()), Decimal('20.00'))
+
+            self.assertEqual(SubcarteiraBanca.consolidar(), Decimal('20.00'))
+            self.carteira.refresh_from_db()
+            self.assertEqual(self.carteira.saldo, Decimal('20.00'))
+            self.assertEqual(Carteira.saldo_banca(), Decimal('20.00'))
+            self.assertEqual(self.carteira.saldo_em(timezone.now()), Decimal('20.00'))
+
+        # Sem a variável, carteiras sem usuário não podem ser tomadas pela banca (usuario IS NULL).
+        with mock.patch.dict(os.environ, {'ID_CARTEIRA_BANCA': ''}):
+            with self.assertRaises(ImproperlyConfigured):
+                Carteira.id_banca()
+
+    def test_saldo_corrente_no_historico(self):
+        self.carteira.depositar(Decimal('100.00'))
+        self.carteira.saque(Decimal('30.00'))
+        Carteira.depositar_em_lote(Decimal('5.00'), [self.carteira.id])
+        saldos = list(self.carteira.historico_transacao.order_by('efetivado_em').values_list('saldo_apos', flat=True))
+        self.assertEqual(saldos, [Decimal('100.00'), Decimal('70.00'), Decimal('75.00')])
+        self.assertEqual(self.carteira.saldo_em(timezone.now()), Decimal('75.00'))
+
+        self.assertEqual(SaldoDiario.registrar(date.today()), 2)
+        self.assertEqual(self.carteira.saldos_diarios.get().saldo, Decimal('75.00'))
+
+        # Execução atrasada: o lançamento de hoje não entra no fechamento de ontem.
+        ontem = date.today() - timedelta(days=1)
+        self.carteira.historico_transacao.filter(valor=Decimal('100.00')).update(
+            efetivado_em=timezone.now() - timedelta(days=1))
+        SaldoDiario.registrar(ontem)
+        self.assertEqual(self.carteira.saldos_diarios.get(data=ontem).saldo, Decimal('100.00'))
+
+        HistoricoTransacao.objects.update(saldo_apos=None)
+        import_module('core.migrations.0004_historico_saldo_apos').preencher_saldo_apos(apps, None)
+        saldos = list(self.carteira.historico_transacao.order_by('efetivado_em').values_list('saldo_apos', flat=True))
+        self.assertEqual(saldos, [Decimal('100.00'), Decimal('70.00'), Decimal('75.00')])
+
+        saida = StringIO()
+        with mock.patch.dict(os.environ, {'ID_CARTEIRA_BANCA': str(self.carteira2.id)}):
+            call_command('conciliar_carteiras', stdout=saida)
+            self.assertIn('Todas as carteiras conferem', saida.getvalue())
+            Carteira.objects.filter(id=self.carteira2.id).update(saldo=Decimal('1.00'))
+            call_command('conciliar_carteiras', stdout=saida)
+            self.assertIn('1 carteiras divergentes', saida.getvalue())
+
     def test_saque_valido(self):
         self.carteira2.depositar(Decimal("100"))
         # Usuário bloqueado
@@ -143,3 +264,64 @@ class UsuarioModelTest(TestCase):
 
     def test_saldo(self):
         self.assertEqual(self.usuario.saldo, Decimal('100.00'))
+
+
+class HistoricoTransfereciaViewSetTest(TestCase):
+
+    def setUp(self):
+        self.usuario = UsuarioFactory(permissoes=PermissoesNotificacaoFactory(email_verificado=True))
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        self.usuario.carteira.saque(Decimal('10.00'))
+        self.usuario.carteira.saque(Decimal('15.00'))
+
+    def test_saldo_da_banca_inclui_subcarteiras(self):
+        with mock.patch.dict(os.environ, {'ID_CARTEIRA_BANCA': str(self.usuario.id)}):
+            Carteira.movimentar_banca(Decimal('5.00'))
+            self.assertEqual(self.client.get('/api/v1/usuario/carteira/').data['saldo'], '80.00')
+            carteira = Carteira.objects.select_related('usuario').get(id=self.usuario.carteira_id)
+            self.assertEqual(CarteiraAdmin(Carteira, site).saldo_total(carteira), Decimal('80.00'))
+        self.assertEqual(self.client.get('/api/v1/usuario/carteira/').data['saldo'], '75.00')
+
+    def test_extrato_enxuto(self):
+        response = self.client.get('/api/v1/usuario/carteira/historico/')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'tipo', 'valor', 'externo', 'saldo_apos',
+                                                            'created_at'})
+
+    def test_resumo_mensal_em_cache_ate_a_proxima_transacao(self):
+        cache.clear()
+        mes = timezone.now().strftime('%Y-%m')
+        response = self.client.get('/api/v1/usuario/carteira/historico/resumo/')
+        self.assertEqual(response.data, [{'mes': mes, 'tipo': 'COMPRA', 'total': '25.00', 'quantidade': 2},
+                                         {'mes': mes, 'tipo': 'GANHO', 'total': '100.00', 'quantidade': 1}])
+        HistoricoTransacao.objects.filter(tipo='GANHO').delete()
+        self.assertEqual(len(self.client.get('/api/v1/usuario/carteira/historico/resumo/').data), 2)
+        self.usuario.carteira.saque(Decimal('5.00'))
+        response = self.client.get('/api/v1/usuario/carteira/historico/resumo/')
+        self.assertEqual(response.data, [{'mes': mes, 'tipo': 'COMPRA', 'total': '30.00', 'quantidade': 3}])
+
+    def test_exportar_extrato(self):
+        response = self.client.get('/api/v1/usuario/carteira/historico/exportar/')
+        linhas = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(linhas[0], 'id,tipo,valor,externo,saldo_apos,created_at')
+        self.assertEqual([linha.split(',')[4] for linha in linhas[1:]], ['100.00', '90.00', '75.00'])
+
+        response = self.client.get('/api/v1/usuario/carteira/historico/exportar/', {'formato': 'ndjson'})
+        linhas = [json.loads(linha) for linha in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([linha['tipo'] for linha in linhas], ['GANHO', 'COMPRA', 'COMPRA'])
+
+    def test_limite_da_asaas_responde_503(self):
+        self.usuario.carteira.depositar(Decimal('100.00'))
+        self.usuario.carteira.refresh_from_db()
+        saldo = self.usuario.carteira.saldo
+        conta = {'code_banco': '001', 'agencia': '1234', 'tipo_conta': 'CONTA_CORRENTE', 'num_conta': '12345',
+                 'digito': '1'}
+        with mock.patch.object(asaas.cliente.limitador, 'adquirir', side_effect=LimiteProvedorExcedido):
+            response = self.client.post('/api/v1/usuario/carteira/depositar/', {'valor': '50.00'}, format='json')
+            self.assertEqual(response.status_code, 503)
+            response = self.client.post('/api/v1/usuario/carteira/sacar/', {'valor': '50.00', 'conta': conta},
+                                        format='json')
+            self.assertEqual(response.status_code, 503)
+        self.usuario.carteira.refresh_from_db()
+        self.assertEqual(self.usuario.carteira.saldo, saldo)